@@ -0,0 +1,237 @@
+#!/usr/bin/python
+"""Throughput/latency benchmarks for the API functions, against a local
+stand-in server (see mockserver.py).
+
+Measures single calls of each public function (one-off module-level calls
+and through a pooled ConvertClient), bulk sweeps (iterExperiences,
+fetchReports, streamExperienceDailyReport), concurrent access (threads
+sharing a ConvertClient, and AsyncConvertClient if aiohttp is installed)
+and micro-benchmarks of getAuthSignature and getCookieData.
+
+The server runs in a separate process so it doesn't compete with the
+client for the GIL. Results are written as JSON (with the git commit they
+were measured at) for comparison across commits:
+
+Usage: python benchmarks/bench_api.py [-n CALLS] [--latency MS] [-o results.json]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+import convertcom
+
+
+APPLICATION_ID = "0123456789abcdef"
+SECRET = "fedcba9876543210fedcba9876543210"
+ACCOUNT_ID = 10001
+PROJECT_ID = 10002
+COOKIE = "vi:1*sc:2*cs:1374079443*fs:1374074823*pv:4*seg:{100246.1}*exp:{10001236.{v.10008683-g.{10001841.1}}-10001237.{v.10008687-g.{10001841.1}}}*ps:1374074823"
+
+
+def startServer(args):
+    """Starts mockserver.py in a subprocess; returns (process, base_url)."""
+    p = subprocess.Popen([
+        sys.executable, os.path.join(ROOT, "benchmarks", "mockserver.py"),
+        "--latency", str(args.latency), "--pages", str(args.pages),
+        "--page-size", str(args.page_size), "--variations", str(args.variations),
+        "--days", str(args.days),
+    ], stdout=subprocess.PIPE, universal_newlines=True)
+    return p, p.stdout.readline().strip()
+
+
+def summarize(latencies, wall, items=None):
+    """Returns latency percentiles (ms) and throughput for a run."""
+    latencies = sorted(latencies)
+    r = {
+        "calls": len(latencies),
+        "wall_s": wall,
+        "calls_per_s": len(latencies) / wall if wall else None,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+        "mean_ms": statistics.mean(latencies) * 1000,
+    }
+    if items is not None:
+        r["items"] = items
+        r["items_per_s"] = items / wall if wall else None
+    return r
+
+
+def timeCalls(calls):
+    """Runs each call in turn; fails if one returns a false value."""
+    latencies = []
+    started = time.perf_counter()
+    for call in calls:
+        t = time.perf_counter()
+        if not call():
+            raise RuntimeError("Benchmark call failed")
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def benchSingle(kwargs, client, ids, n):
+    ids = (ids * (n // len(ids) + 1))[:n]
+    a, p = ACCOUNT_ID, PROJECT_ID
+    functions = {
+        "listExperiences": lambda i, k: convertcom.listExperiences(a, p, **k),
+        "getExperience": lambda i, k: convertcom.getExperience(a, p, i, **k),
+        "getExperienceStats": lambda i, k: convertcom.getExperienceStats(a, p, i, **k),
+        "getExperienceDailyReport": lambda i, k: convertcom.getExperienceDailyReport(a, p, i, **k),
+        "getExperienceAggregatedReport": lambda i, k: convertcom.getExperienceAggregatedReport(a, p, i, **k),
+        "getExperienceVariantMaps": lambda i, k: convertcom.getExperienceVariantMaps(a, p, **k)[0],
+    }
+    results = {}
+    for name, f in functions.items():
+        results[name] = {
+            "oneoff": timeCalls([lambda i=i: f(i, kwargs) for i in ids]),
+            "client": timeCalls([lambda i=i: f(i, client._kwargs({})) for i in ids]),
+        }
+    return results
+
+
+def benchBulk(client, ids):
+    results = {}
+
+    started = time.perf_counter()
+    count = sum(1 for _ in client.iterExperiences(ACCOUNT_ID, PROJECT_ID))
+    wall = time.perf_counter() - started
+    results["iterExperiences"] = {"wall_s": wall, "items": count, "items_per_s": count / wall}
+
+    started = time.perf_counter()
+    count = 0
+    for _, _, r in client.fetchReports(ACCOUNT_ID, PROJECT_ID, ids):
+        if r is False:
+            raise RuntimeError("fetchReports call failed")
+        count += 1
+    wall = time.perf_counter() - started
+    results["fetchReports"] = {"wall_s": wall, "items": count, "items_per_s": count / wall}
+
+    started = time.perf_counter()
+    count = sum(1 for _ in client.streamExperienceDailyReport(ACCOUNT_ID, PROJECT_ID, ids[0]))
+    wall = time.perf_counter() - started
+    results["streamExperienceDailyReport"] = {"wall_s": wall, "items": count, "items_per_s": count / wall}
+    return results
+
+
+def benchThreads(client, ids, concurrency):
+    def call(i):
+        t = time.perf_counter()
+        if not client.getExperienceStats(ACCOUNT_ID, PROJECT_ID, i):
+            raise RuntimeError("Benchmark call failed")
+        return time.perf_counter() - t
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(call, ids))
+    return summarize(latencies, time.perf_counter() - started)
+
+
+def benchAsync(base_url, ids, concurrency):
+    async def run():
+        async with convertcom.AsyncConvertClient(APPLICATION_ID, SECRET, base_url=base_url,
+                                                 limit_per_host=concurrency) as c:
+            async def call(i):
+                t = time.perf_counter()
+                if not await c.getExperienceStats(ACCOUNT_ID, PROJECT_ID, i):
+                    raise RuntimeError("Benchmark call failed")
+                return time.perf_counter() - t
+
+            started = time.perf_counter()
+            latencies = await asyncio.gather(*[call(i) for i in ids])
+            return summarize(latencies, time.perf_counter() - started)
+
+    return asyncio.run(run())
+
+
+def benchMicro(number):
+    url = convertcom.GET_EXPERIENCE_URL.format(account_id=ACCOUNT_ID, project_id=PROJECT_ID, experience_id=1001)
+    body = json.dumps({"include": ["variations"], "expand": ["variations"]})
+    signer = convertcom.RequestSigner(APPLICATION_ID, SECRET)
+    counter = iter(range(10 ** 9))
+
+    def usec(f):
+        return min(timeit.repeat(f, number=number, repeat=5)) / number * 1e6
+
+    return {
+        "getAuthSignature_us": usec(lambda: convertcom.getAuthSignature(APPLICATION_ID, 1700000000, url, body, SECRET)),
+        "RequestSigner.signature_us": usec(lambda: signer.signature(next(counter), url, body)),
+        "getCookieData_us": usec(lambda: convertcom.getCookieData(COOKIE)),
+        "ConvertVisitorCookie_us": usec(lambda: convertcom.ConvertVisitorCookie(COOKIE)),
+    }
+
+
+def gitCommit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--calls', type=int, default=50, help="calls per single-call benchmark")
+    parser.add_argument('-c', '--concurrency', type=int, default=16, help="threads/connections for the concurrent runs")
+    parser.add_argument('--latency', type=float, default=5, help="server delay per response, in ms")
+    parser.add_argument('--pages', type=int, default=4, help="pages of experiences")
+    parser.add_argument('--page-size', type=int, default=25, help="experiences per page")
+    parser.add_argument('--variations', type=int, default=3, help="variations per experience")
+    parser.add_argument('--days', type=int, default=90, help="days per daily report")
+    parser.add_argument('--micro', type=int, default=20000, help="iterations per micro-benchmark run")
+    parser.add_argument('-o', '--output', type=str, help="write results to this JSON file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    server, base_url = startServer(args)
+    try:
+        ids = list(range(1001, 1001 + args.pages * args.page_size))
+        kwargs = {"application_id": APPLICATION_ID, "secret": SECRET, "base_url": base_url,
+                  "singleflight": False}
+        results = {
+            "commit": gitCommit(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": vars(args),
+        }
+        with convertcom.ConvertClient(APPLICATION_ID, SECRET, base_url=base_url,
+                                      pool_maxsize=args.concurrency) as client:
+            results["single"] = benchSingle(kwargs, client, ids, args.calls)
+            results["bulk"] = benchBulk(client, ids)
+            results["concurrent"] = {"threads": benchThreads(client, ids, args.concurrency)}
+        try:
+            results["concurrent"]["asyncio"] = benchAsync(base_url, ids, args.concurrency)
+        except ImportError as e:
+            results["concurrent"]["asyncio"] = {"skipped": str(e)}
+        results["micro"] = benchMicro(args.micro)
+    finally:
+        server.terminate()
+        server.wait()
+
+    for name, r in results["single"].items():
+        print("{:32} one-off p50 {:7.2f} ms  client p50 {:7.2f} ms".format(
+            name, r["oneoff"]["p50_ms"], r["client"]["p50_ms"]))
+    for name, r in results["bulk"].items():
+        print("{:32} {:9.1f} items/s".format(name, r["items_per_s"]))
+    for name, r in results["concurrent"].items():
+        if "calls_per_s" in r:
+            print("{:32} {:9.1f} calls/s  p99 {:7.2f} ms".format(
+                "concurrent " + name, r["calls_per_s"], r["p99_ms"]))
+    for name, v in results["micro"].items():
+        print("{:32} {:9.2f} usec".format(name, v))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
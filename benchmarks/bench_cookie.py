@@ -0,0 +1,140 @@
+#!/usr/bin/python
+"""Micro-benchmark for convertcom.getCookieData.
+
+Compares the single-pass cookie parser against the original
+replace/re.sub/json.loads implementation (kept below for reference) and
+checks that both produce the same output. Also times the lazy
+ConvertVisitorCookie when only experiment/variation pairs are needed, and
+looking those pairs up in the string-keyed getExperienceVariantMaps maps
+against an ExperienceIndex.
+
+Usage: python benchmarks/bench_cookie.py [-n NUMBER]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+from datetime import datetime
+from urllib.parse import unquote
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from convertcom import getCookieData, ConvertVisitorCookie, ExperienceIndex
+
+
+COOKIES = [
+    "vi:1*sc:2*cs:1374079443*fs:1374074823*pv:4*seg:{100246.1}*exp:{10001236.{v.10008683-g.{10001841.1}}-10001237.{v.10008687-g.{10001841.1}}}*ps:1374074823",
+    "vi:1*sc:1*cs:1700000000*fs:1700000000*pv:1*seg:{}*exp:{}",
+    "vi%3Aabc123*sc%3A7*cs%3A1712345678*fs%3A1701234567*pv%3A42*seg%3A%7B100246.1%7D*exp%3A%7B100453369.%7Bv.1004107469-g.%7B100130612.1-100130613.1%7D%7D%7D*ps%3A1711111111",
+]
+
+
+def legacyGetCookieData(cookieStr):
+    """The original getCookieData (minus its debug print)."""
+    parts = cookieStr.split("*")
+    data = {}
+
+    if ":" not in cookieStr:
+      cookieStr = unquote(cookieStr)
+      parts = cookieStr.split("*")
+    for p in parts:
+        if p.startswith("vi"):
+            k, v = p.split(":")
+            data["Customer provided ID?"] = False if v == 1 else v
+        if p.startswith("sc"):
+            k, v = p.split(":")
+            data["Session Count"] = int(v)
+        if p.startswith("cs"):
+            k, v = p.split(":")
+            data["Current Session Timestamp"] = datetime.utcfromtimestamp(int(v)).strftime('%Y-%m-%d %H:%M:%S')
+        if p.startswith("fs"):
+            k, v = p.split(":")
+            data["First Session Start Timestamp"] = datetime.utcfromtimestamp(int(v)).strftime('%Y-%m-%d %H:%M:%S')
+        if p.startswith("pv"):
+            k, v = p.split(":")
+            data["Total Pageview Count"] = int(v)
+        if p.startswith("ps"):
+            k, v = p.split(":")
+            data["Previous Session Start Timestamp"] = datetime.utcfromtimestamp(int(v)).strftime('%Y-%m-%d %H:%M:%S')
+        if p.startswith("seg"):
+            k, v = p.split(":")
+            s = v.replace('.', ':')
+            s = re.sub(r'([a-z0-9]+):', r'"\1":', s, flags=re.MULTILINE)
+            j = json.loads(s)
+            data["Segments"] = j
+        if p.startswith("exp"):
+            k, v = p.split(":")
+            s = v.replace('-', ',')
+            s = s.replace('.', ':')
+            s = re.sub(r'([a-z0-9]+):', r'"\1":', s, flags=re.MULTILINE)
+            j = json.loads(s)
+            data["Experiments"] = j
+
+    return data
+
+
+# The experiences in COOKIES, as the listing returns them
+EXPERIENCES = [
+    {"id": 10001236, "key": "exp-a", "name": "A", "status": "active", "type": "a/b", "goals": [10001841],
+     "variations": [{"id": 10008683, "key": "original"}, {"id": 10008684, "key": "var-1"}]},
+    {"id": 10001237, "key": "exp-b", "name": "B", "status": "active", "type": "a/b", "goals": [10001841],
+     "variations": [{"id": 10008686, "key": "original"}, {"id": 10008687, "key": "var-1"}]},
+    {"id": 100453369, "key": "exp-c", "name": "C", "status": "active", "type": "a/b",
+     "goals": [100130612, 100130613],
+     "variations": [{"id": 1004107468, "key": "original"}, {"id": 1004107469, "key": "var-1"}]},
+]
+
+
+def bench(f, number, items=COOKIES):
+    t = min(timeit.repeat(lambda: [f(c) for c in items], number=number, repeat=5))
+    return t / (number * len(items)) * 1e6 # usec per cookie
+
+
+if __name__ == "__main__":
+    import warnings
+    warnings.simplefilter("ignore", DeprecationWarning) # datetime.utcfromtimestamp
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=20000, help="iterations per run")
+    args = parser.parse_args()
+
+    for c in COOKIES:
+        assert getCookieData(c) == legacyGetCookieData(c), c
+
+    for c in COOKIES:
+        assert ConvertVisitorCookie(c).to_dict() == getCookieData(c), c
+
+    old = bench(legacyGetCookieData, args.number)
+    new = bench(getCookieData, args.number)
+    lazy = bench(lambda c: ConvertVisitorCookie(c).experimentVariations(), args.number)
+    print("legacy parser:      {:.2f} usec/cookie".format(old))
+    print("single-pass parser: {:.2f} usec/cookie".format(new))
+    print("speedup:            {:.2f}x".format(old / new))
+    print("ConvertVisitorCookie, experiment/variation pairs only: {:.2f} usec/cookie".format(lazy))
+
+    index = ExperienceIndex(EXPERIENCES)
+    eMap, vMap = index.variantMaps()
+    for c in COOKIES:
+        keys = {eMap[i]: vMap[i][str(d["v"])] for i, d in (getCookieData(c).get("Experiments") or {}).items()}
+        assert index.resolveKeys(c) == keys, c
+
+    def lookupMaps(pairs):
+        """The str()-keyed lookups the resolvers do with the maps."""
+        out = []
+        for e, v in pairs.items():
+            i = str(e)
+            k = eMap.get(i)
+            out.append((k, (vMap.get(i) or {}).get(str(v)) if k is not None else None))
+        return out
+
+    # both on the same pre-parsed pairs, so only the lookups are timed
+    pairs = [ConvertVisitorCookie(c).experimentVariations() for c in COOKIES]
+    for p in pairs:
+        assert [(e and e.key, v and v.key) for e, v in index.resolveVariations(p)] == lookupMaps(p), p
+    maps = bench(lookupMaps, args.number, pairs)
+    indexed = bench(index.resolveVariations, args.number, pairs)
+    print("look up pairs in getExperienceVariantMaps maps: {:.2f} usec/cookie".format(maps))
+    print("look up pairs in ExperienceIndex:               {:.2f} usec/cookie".format(indexed))
@@ -0,0 +1,72 @@
+#!/usr/bin/python
+"""Import-time benchmark for the convertcom package.
+
+Times `import convertcom` (and `from convertcom import getCookieData`) in
+fresh interpreters, and checks that it loads no networking modules and
+doesn't configure logging. Exits with status 1 if a check fails or the
+median import time exceeds --max-ms, so it can guard against regressions.
+
+Usage: python benchmarks/bench_import.py [-n RUNS] [--max-ms MS]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Must not be loaded by importing the package or the cookie parser
+FORBIDDEN_MODULES = ("requests", "urllib3", "aiohttp", "hmac", "hashlib",
+                     "multiprocessing", "sqlite3", "convertcom.api")
+
+PROBE = """
+import sys, time
+sys.path.insert(0, {root!r})
+before = set(sys.modules)
+t = time.perf_counter()
+{stmt}
+elapsed = time.perf_counter() - t
+import json, logging
+print(json.dumps({{
+    "ms": elapsed * 1000,
+    "modules": sorted(set(sys.modules) - before),
+    "root_handlers": len(logging.getLogger().handlers),
+}}))
+"""
+
+
+def probe(stmt):
+    # -E -s: ignore the environment and user site-packages, for stable timings
+    out = subprocess.check_output([sys.executable, "-E", "-s", "-c", PROBE.format(stmt=stmt, root=ROOT)])
+    return json.loads(out)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--runs', type=int, default=20, help="fresh interpreters per statement")
+    parser.add_argument('--max-ms', type=float, default=50.0, help="fail above this median import time")
+    args = parser.parse_args()
+
+    failed = False
+    for stmt in ("import convertcom", "from convertcom import getCookieData"):
+        results = [probe(stmt) for _ in range(args.runs)]
+        median = statistics.median(r["ms"] for r in results)
+        loaded = [m for m in FORBIDDEN_MODULES if m in results[0]["modules"]]
+        print("{:40} {:7.2f} ms median, {} modules loaded".format(
+            stmt, median, len(results[0]["modules"])))
+
+        if loaded:
+            print("  FAIL: loads {}".format(", ".join(loaded)))
+            failed = True
+        if results[0]["root_handlers"]:
+            print("  FAIL: configures the root logger")
+            failed = True
+        if median > args.max_ms:
+            print("  FAIL: slower than {} ms".format(args.max_ms))
+            failed = True
+
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,68 @@
+#!/usr/bin/python
+"""Micro-benchmark for per-request signing overhead.
+
+Compares building the auth headers the original way (datetime arithmetic,
+json.dumps of the body and a freshly keyed HMAC via getAuthSignature) with
+a RequestSigner, both for distinct requests and for repeated identical ones
+(where the signature is reused within its Expires window).
+
+Usage: python benchmarks/bench_signing.py [-n NUMBER]
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from convertcom import getAuthSignature, RequestSigner, GET_EXPERIENCE_URL
+
+
+APPLICATION_ID = "0123456789abcdef"
+SECRET = "fedcba9876543210fedcba9876543210"
+URL = GET_EXPERIENCE_URL.format(account_id=10001, project_id=10002, experience_id=10003)
+
+
+def legacyHeaders(url):
+    expires_datetime = datetime.now(tz=None) + timedelta(seconds=30)
+    expires_timestamp = int(expires_datetime.timestamp())
+    body = json.dumps({
+        'include': ["variations", "stats"],
+        'expand': ["variations"]
+    })
+    s = getAuthSignature(APPLICATION_ID, expires_timestamp, url, body, SECRET)
+    return {
+        "Expires": str(expires_timestamp),
+        "Convert-Application-ID": APPLICATION_ID,
+        "Authorization": "Convert-HMAC-SHA256 Signature={}".format(s)
+    }
+
+
+def bench(f, number):
+    return min(timeit.repeat(f, number=number, repeat=5)) / number * 1e6 # usec per request
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=20000, help="iterations per run")
+    args = parser.parse_args()
+
+    body = json.dumps({
+        'include': ["variations", "stats"],
+        'expand': ["variations"]
+    })
+    signer = RequestSigner(APPLICATION_ID, SECRET)
+    h = signer.headers(URL, body)
+    assert h["Authorization"] == "Convert-HMAC-SHA256 Signature={}".format(
+        getAuthSignature(APPLICATION_ID, h["Expires"], URL, body, SECRET))
+
+    counter = iter(range(10 ** 9))
+    old = bench(lambda: legacyHeaders(URL), args.number)
+    fresh = bench(lambda: signer.signature(next(counter), URL, body), args.number)
+    reused = bench(lambda: signer.headers(URL, body), args.number)
+    print("getAuthSignature + datetime + json.dumps: {:.2f} usec/request".format(old))
+    print("RequestSigner, new signature:             {:.2f} usec/request".format(fresh))
+    print("RequestSigner, reused signature:          {:.2f} usec/request".format(reused))
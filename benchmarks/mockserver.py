@@ -0,0 +1,259 @@
+#!/usr/bin/python
+"""Local stand-in for the Convert.com v2 API, for benchmarks.
+
+Serves the endpoints the library uses (project and experience listings,
+experiences, daily and aggregated reports) with generated data, after an
+artificial delay. Daily reports honour a start_time/end_time range.
+Signatures aren't checked. Point the library at it with the base_url
+kwarg (or ConvertClient/AsyncConvertClient's base_url):
+
+    server = MockConvertServer(latency=0.02, pages=5).start()
+    convertcom.getExperience(1, 1, 1001, base_url=server.base_url, ...)
+    server.stop()
+
+Or run it on its own; it prints its base URL on the first line:
+
+    python benchmarks/mockserver.py --port 8000 --latency 20 --pages 5
+"""
+
+import argparse
+import json
+import re
+import sys
+import threading
+import time
+from calendar import timegm
+from datetime import date, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+ROUTES = (
+    ("projects", re.compile(r"^/api/v2/accounts/(\d+)/projects/?$")),
+    ("experiences", re.compile(r"^/api/v2/accounts/(\d+)/projects/(\d+)/experiences/?$")),
+    ("experience", re.compile(r"^/api/v2/accounts/(\d+)/projects/(\d+)/experiences/(\d+)/?$")),
+    ("daily", re.compile(r"^/api/v2/accounts/(\d+)/projects/(\d+)/experiences/(\d+)/daily_report/?$")),
+    ("aggregated", re.compile(r"^/api/v2/accounts/(\d+)/projects/(\d+)/experiences/(\d+)/aggregated_report/?$")),
+)
+
+FIRST_EXPERIENCE_ID = 1001
+START_DATE = date(2024, 1, 1)
+
+
+class MockConvertServer(object):
+    """Threaded HTTP server with generated API responses.
+
+    `latency` seconds are slept before every response. Each project has
+    pages * page_size experiences (listed page_size at a time, unless the
+    request asks for another results_per_page), each with `variations`
+    variations and `days` days of report data.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, pages=1, page_size=50,
+                 variations=3, days=30, projects=3):
+        self.latency = latency
+        self.pages = pages
+        self.page_size = page_size
+        self.variations = variations
+        self.days = days
+        self.projects = projects
+        self.requests = 0 # served so far
+
+        self._lock = threading.Lock()
+        self._bodies = {} # encoded responses, so the server isn't the bottleneck
+        server = self
+        class Handler(_Handler):
+            mock = server
+        self.httpd = _Server((host, port), Handler)
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    @property
+    def experience_ids(self):
+        return list(range(FIRST_EXPERIENCE_ID, FIRST_EXPERIENCE_ID + self.pages * self.page_size))
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # -------- Generated data -----------
+
+    def experience(self, experience_id):
+        variations = [{
+            "id": experience_id * 100 + i,
+            "key": "variation-{}".format(i),
+            "name": "Variation {}".format(i) if i else "Original",
+            "traffic_distribution": 100.0 / self.variations,
+        } for i in range(self.variations)]
+        return {
+            "id": experience_id,
+            "key": "experience-{}".format(experience_id),
+            "name": "Experience {}".format(experience_id),
+            "status": "active",
+            "type": "a/b",
+            "goals": [experience_id * 10 + 1, experience_id * 10 + 2],
+            "variations": variations,
+            "stats": {
+                "conversions": 100 * self.variations,
+                "variations_observed_results": [{
+                    "variation_id": v["id"],
+                    "variation_name": v["name"],
+                    "test_result": "winner" if i == 1 else "not_significant",
+                    "improvement": 0.05 * i,
+                } for i, v in enumerate(variations)],
+            },
+        }
+
+    def report(self, experience_id, daily=True, start_time=None, end_time=None):
+        """Generates a report; a daily report only includes the days from
+        start_time to end_time (unix timestamps), if given."""
+        variations = []
+        for i in range(self.variations):
+            vid = experience_id * 100 + i
+            visitors = conversions = 0
+            stats = []
+            for d in range(self.days if daily else 1):
+                dayVisitors = 1000 + (vid * 7 + d * 13) % 200
+                dayConversions = 30 + i * 3 + (vid + d) % 10
+                visitors += dayVisitors
+                conversions += dayConversions
+                day = START_DATE + timedelta(days=d)
+                dayStart = timegm(day.timetuple())
+                if daily and ((start_time and dayStart + 86400 <= start_time) or
+                              (end_time and dayStart > end_time)):
+                    continue
+                stats.append({
+                    "date": day.isoformat(),
+                    "visitors": dayVisitors if daily else visitors,
+                    "conversions": dayConversions if daily else conversions,
+                    "revenue": round(dayConversions * 42.5, 2),
+                    "totals": conversions,
+                })
+            variations.append({"id": vid, "stats": stats})
+        return {
+            "reportData": {"variations": variations},
+            "variations_data": self.experience(experience_id)["variations"],
+        }
+
+    def respond(self, route, ids, params):
+        """Returns the response object for a request."""
+        if route == "projects":
+            return {"data": [{"id": p, "name": "Project {}".format(p)}
+                             for p in range(1, self.projects + 1)]}
+        if route == "experiences":
+            perPage = int(params.get("results_per_page") or self.page_size)
+            ids = self.experience_ids
+            pagesCount = max(1, -(-len(ids) // perPage))
+            page = int(params.get("page") or 1)
+            return {
+                "data": [self.experience(i) for i in ids[(page - 1) * perPage:page * perPage]],
+                "extra": {"pagination": {
+                    "current_page": page,
+                    "items_count": len(ids),
+                    "items_per_page": perPage,
+                    "pages_count": pagesCount,
+                }},
+            }
+        if route == "experience":
+            return {"data": self.experience(int(ids[2]))}
+        return {"data": self.report(int(ids[2]), daily=(route == "daily"),
+                                    start_time=params.get("start_time"),
+                                    end_time=params.get("end_time"))}
+
+    def body(self, route, ids, params):
+        key = (route, ids, params.get("page"), params.get("results_per_page"),
+               params.get("start_time"), params.get("end_time"), self.days)
+        b = self._bodies.get(key)
+        if b is None:
+            b = self._bodies[key] = json.dumps(self.respond(route, ids, params)).encode()
+        return b
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 # the default 5 drops concurrent connects
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive, like the real API
+    # headers and body go out in separate writes; without this, Nagle's
+    # algorithm delays every response on a reused connection by ~40ms
+    disable_nagle_algorithm = True
+    mock = None
+
+    def _handle(self):
+        n = int(self.headers.get("content-length") or 0)
+        raw = self.rfile.read(n) if n else b""
+        try:
+            params = json.loads(raw) if raw else {}
+        except ValueError:
+            params = {}
+        if not isinstance(params, dict):
+            params = {}
+
+        path = self.path.split("?", 1)[0]
+        for route, pattern in ROUTES:
+            m = pattern.match(path)
+            if m:
+                break
+        else:
+            route = None
+
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+        with self.mock._lock:
+            self.mock.requests += 1
+
+        if route is None:
+            status = 404
+            b = json.dumps({"isError": True, "code": 404, "message": "Not found"}).encode()
+        else:
+            status = 200
+            b = self.mock.body(route, m.groups(), params)
+
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(b)))
+        self.end_headers()
+        self.wfile.write(b)
+
+    do_GET = do_POST = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=0, help="0 picks a free port")
+    parser.add_argument('--latency', type=float, default=0, help="delay per response, in ms")
+    parser.add_argument('--pages', type=int, default=1, help="pages of experiences per project")
+    parser.add_argument('--page-size', type=int, default=50, help="experiences per page")
+    parser.add_argument('--variations', type=int, default=3, help="variations per experience")
+    parser.add_argument('--days', type=int, default=30, help="days per daily report")
+    args = parser.parse_args()
+
+    server = MockConvertServer(args.host, args.port, latency=args.latency / 1000.0,
+                               pages=args.pages, page_size=args.page_size,
+                               variations=args.variations, days=args.days)
+    print(server.base_url)
+    sys.stdout.flush()
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
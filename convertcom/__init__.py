@@ -22,398 +22,74 @@ tool's REST API. Read more about this library at
 https://github.com/CampaignTrip/convertapi-python
 r
 
-TODO: Make this into an actual client (object-oriented).
+The API functions (see api.py) make one-off calls. For repeated calls,
+use ConvertClient (see client.py), which reuses a pooled HTTP session, or
+AsyncConvertClient (see aio.py) to run many calls concurrently.
+
+Importing the package only loads the cookie parser, which needs nothing
+but the standard library; everything else (and requests or aiohttp) is
+loaded on first use. The package doesn't configure logging; scripts
+should call logging.basicConfig themselves.
 ~~~~~~
 """
 
-#from . import
-
-import json
-import logging
-import traceback
-
-import hmac
-import hashlib
-import binascii
-
-from datetime import datetime, timedelta
-import time
-import re
-
-import requests
-from urllib.parse import urlencode, unquote
-
-
-logging.basicConfig(
-    format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s::%(funcName)s(): %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S',
-)
-log = logging.getLogger()
-
-LIST_EXPERIENCES_URL = "https://api.convert.com/api/v2/accounts/{account_id}/projects/{project_id}/experiences"
-LIST_PROJECTS_URL = "https://api.convert.com/api/v2/accounts/{account_id}/projects"
-GET_EXPERIENCE_URL = "https://api.convert.com/api/v2/accounts/{account_id}/projects/{project_id}/experiences/{experience_id}"
-GET_EXPERIENCE_DAILY_REPORT_URL = "https://api.convert.com/api/v2/accounts/{account_id}/projects/{project_id}/experiences/{experience_id}/daily_report"
-GET_EXPERIENCE_AGG_REPORT_URL = "https://api.convert.com/api/v2/accounts/{account_id}/projects/{project_id}/experiences/{experience_id}/aggregated_report"
-#GET_VARIATIONS_URL = "https://api.convert.com/api/v2/accounts/{account_id}/projects/{project_id}/experiences/{experience_id}/variations/{variation_id}"
-
-def doRequest(url, method, extra_headers, **opts):
-    """Performs the actual call to Convert.com API"""
-    verbose = opts.get('verbose', 0)
-    getData = opts.get('get_data', False)
-    headers = {'content-type': 'application/json'}
-    params = opts.get('params', {})
-    body = opts.get('body', "")
-
-    if extra_headers:
-        headers.update(extra_headers)
-
-    log.debug("Making '{}' request to URL ({}) with headers: {}".format(
-        method, url, headers))
-    r = None
-    try:
-        if method == 'GET':
-            r = requests.get(url, headers=headers, params=params, data=body)
-        elif method == 'POST':
-            r = requests.post(url, headers=headers, params=params, data=body)
-        # TODO add DEL
-        else:
-            raise ValueError('Undefined HTTP method "{}"'.format(method))
-
-        d = None
-        if r.status_code != 204 and \
-                r.headers["content-type"].strip().startswith("application/json"):
-            d = r.json()
-
-            log.debug("Response ({}): {}".format(r.status_code, d))
-            if verbose > 1:
-                log.debug(json.dumps(d, indent=2))
-
-            if r.status_code >= 200 and r.status_code <= 202:
-                if verbose > 1:
-                    log.debug("Success!")
-                return d["data"] if getData else d
-
-        if r.status_code >= 400 and d != None:
-            if d["isError"]:
-                log.error("Received an error response ({}) making {} request to '{}': {}".format(
-                    r.status_code, method, url, d["message"]))
-            else:
-                log.error("Received bad status code '{}' when making {} request to '{}': {}".format(
-                    r.status_code, method, url, r.content))
-        elif d == None:
-            log.error("Unknown response ({}) when making {} request to url '{}': {}".format(
-                r.status_code, method, url, r.content))
-    except Exception as e:
-        log.error("Failed to do {} request to '{}' with error: {}".format(
-            method, url, e))
-        log.error("Request error contet: {}".format(str(r.content)))
-        log.error(traceback.format_exc())
-    return False
-
-
-def getAuthSignature(application_id, expires_timestamp, url, body, secret, **kwargs):
-    """
-    """
-    verbose = kwargs.get('verbose', 0)
-    signStr = "{appId}\n{expires}\n{url}\n{body}".format(
-	appId=application_id, expires=expires_timestamp, url=url, body=body)
-
-    msg = bytes(signStr, 'utf-8')
-    secret = bytes(secret, 'utf-8')
-    if verbose > 0:
-        log.debug("Signstr: {}".format(signStr))
-
-    signature = str(binascii.hexlify(hmac.new(
-        secret, msg,
-        digestmod=hashlib.sha256
-    ).digest()), 'ascii')
-
-    log.debug("Signature: \"{}\"".format(signature))
-    return signature
-
-def listExperiences(account_id, project_id, **kwargs):
-    """
-    """
-    verbose = kwargs.get('verbose', 0)
-    u = LIST_EXPERIENCES_URL.format(
-        account_id=account_id,
-        project_id=project_id)
-
-    application_id = kwargs.get('application_id')
-    secret = kwargs.get('secret')
-
-    expires_datetime = datetime.now(tz=None) + timedelta(seconds=30)
-    expires_timestamp = int(expires_datetime.timestamp())
-
-
-    # Body params?
-    body = ""
-    if kwargs.get('bodyParams', False):
-        body = json.dumps(kwargs.get('bodyParams'))
-
-    s = getAuthSignature(application_id, expires_timestamp, u, body, secret, verbose=verbose)
-
-    method = 'POST'
-
-    opts = {
-        "verbose": verbose,
-        "body": body,
-        "get_data": True # return the 'data' field from response data
-    }
-
-    data = doRequest(u, method, {
-        "Expires": str(expires_timestamp),
-        "Convert-Application-ID": application_id,
-        "Authorization": "Convert-HMAC-SHA256 Signature={}".format(s)
-    }, **opts)
-
-    # TODO support pages!
-    return data
-
-
-def getExperience(account_id, project_id, experience_id, **kwargs):
-    verbose = kwargs.get('verbose', 0)
-
-    u = GET_EXPERIENCE_URL.format(
-        account_id=account_id,
-        project_id=project_id,
-        experience_id=experience_id
-    )
-
-    application_id = kwargs.get('application_id')
-    secret = kwargs.get('secret')
-
-    expires_datetime = datetime.now(tz=None) + timedelta(seconds=30)
-    expires_timestamp = int(expires_datetime.timestamp())
-
-    # We want variation data to be expanded
-    body = json.dumps({
-        'include': ["variations"],
-        'expand': ["variations"]
-    })
-
-    s = getAuthSignature(application_id, expires_timestamp, u, body, secret)
-    log.debug("Signature: \"{}\"".format(s))
-
-    method = 'GET'
-    opts = {
-        "verbose": verbose,
-        "body": body
-    }
-
-    data = doRequest(u, method, {
-        "Expires": str(expires_timestamp),
-        "Convert-Application-ID": application_id,
-        "Authorization": "Convert-HMAC-SHA256 Signature={}".format(s)
-    }, **opts)
-
-    return data
-
-
-#def listVariations(account_id, project_id, experience_id, **kwargs):
-#    https://api.convert.com/api/v2/accounts/{account_id}/projects/{project_id}/experiences/{experience_id}/variations/{variation_id}/update
-
-def getExperienceVariantMaps(account_id, project_id, **kwargs):
-    """Returns a tuple of dicts: the first is a dict of experience id/key-name pairs,
-    and the second is a dict of variant keys indexed by id.
-    """
-    d = listExperiences(account_id, project_id,
-                        bodyParams={
-                            'include': ["variations"],
-                            'expand': ["variations"]
-                        }, **kwargs)
-    if not d:
-        log.error("Failed to list experiences in account/project {accountId}/{projectId}!".format(
-            accountId=accountId, projectId=projectId
-        ))
-        return (False, False)
-
-    eMap = {}
-    vMap = {}
-    for e in d:
-        i = str(e['id'])
-        n = e['name']
-        k = e['key']
-
-        eMap.update({i: k})
-
-        for v in e['variations']:
-            vi = str(v['id'])
-            vk = v['key']
-
-            if i not in vMap:
-                vMap.update({i: {}})
-            vMap[i].update({vi: vk})
-
-    return (eMap, vMap)
-
-
-def getExperienceStats(account_id, project_id, experience_id, **kwargs):
-    verbose = kwargs.get('verbose', 0)
-
-    u = GET_EXPERIENCE_URL.format(
-        account_id=account_id,
-        project_id=project_id,
-        experience_id=experience_id
-    )
-
-    application_id = kwargs.get('application_id')
-    secret = kwargs.get('secret')
-
-    expires_datetime = datetime.now(tz=None) + timedelta(seconds=30)
-    expires_timestamp = int(expires_datetime.timestamp())
-
-    # We want variation data to be expanded
-    body = json.dumps({
-        'include': ["variations", "stats"],
-        'expand': ["variations"]
-    })
-
-    s = getAuthSignature(application_id, expires_timestamp, u, body, secret)
-    log.debug("Signature: \"{}\"".format(s))
-
-    method = 'GET'
-    opts = {
-        "verbose": verbose,
-        "body": body
-    }
-
-    data = doRequest(u, method, {
-        "Expires": str(expires_timestamp),
-        "Convert-Application-ID": application_id,
-        "Authorization": "Convert-HMAC-SHA256 Signature={}".format(s)
-    }, **opts)
-
-    return data
-
-def getExperienceDailyReport(account_id, project_id, experience_id, **kwargs):
-    verbose = kwargs.get('verbose', 0)
-
-    u = GET_EXPERIENCE_DAILY_REPORT_URL.format(
-        account_id=account_id,
-        project_id=project_id,
-        experience_id=experience_id
-    )
-
-    application_id = kwargs.get('application_id')
-    secret = kwargs.get('secret')
-
-    expires_datetime = datetime.now(tz=None) + timedelta(seconds=30)
-    expires_timestamp = int(expires_datetime.timestamp())
-
-    # We want variation data to be expanded
-    body = ""
-    """
-    body = json.dumps({
-        'include': ["variations", "stats"],
-        'expand': ["variations"]
-    })
-    """
-
-    s = getAuthSignature(application_id, expires_timestamp, u, body, secret)
-    log.debug("Signature: \"{}\"".format(s))
-
-    method = 'POST'
-    opts = {
-        "verbose": verbose,
-        "body": body
-    }
-
-    data = doRequest(u, method, {
-        "Expires": str(expires_timestamp),
-        "Convert-Application-ID": application_id,
-        "Authorization": "Convert-HMAC-SHA256 Signature={}".format(s)
-    }, get_data=True, **opts)
-
-    return data
-
-
-def getExperienceAggregatedReport(account_id, project_id, experience_id, **kwargs):
-    verbose = kwargs.get('verbose', 0)
-
-    u = GET_EXPERIENCE_AGG_REPORT_URL.format(
-        account_id=account_id,
-        project_id=project_id,
-        experience_id=experience_id
-    )
-
-    application_id = kwargs.get('application_id')
-    secret = kwargs.get('secret')
-
-    expires_datetime = datetime.now(tz=None) + timedelta(seconds=30)
-    expires_timestamp = int(expires_datetime.timestamp())
-
-    # We want variation data to be expanded
-    #body = ""
-    body = json.dumps({
-        'metrics': ["conversion_rate", "avg_revenue_visitor", "avg_products_ordered_visitor"],
-    })
-
-    s = getAuthSignature(application_id, expires_timestamp, u, body, secret)
-    log.debug("Signature: \"{}\"".format(s))
-
-    method = 'POST'
-    opts = {
-        "verbose": verbose,
-        "body": body
-    }
-
-    data = doRequest(u, method, {
-        "Expires": str(expires_timestamp),
-        "Convert-Application-ID": application_id,
-        "Authorization": "Convert-HMAC-SHA256 Signature={}".format(s)
-    }, get_data=True, **opts)
-
-    return data
-
-
-# -------- Non-API Functions -----------
-
-''' Example cookie value:
-vi:1*sc:2*cs:1374079443*fs:1374074823*pv:4*seg:{100246.1}*exp:{10001236.{v.10008683-g.{10001841.1}}-10001237.{v.10008687-g.{10001841.1}}}*ps:1374074823
-'''
-
-def getCookieData(cookieStr):
-    parts = cookieStr.split("*")
-    data = {}
-
-    if ":" not in cookieStr:
-      cookieStr = unquote(cookieStr)
-      print(cookieStr)
-      parts = cookieStr.split("*")
-    for p in parts:
-        if p.startswith("vi"):
-            k, v = p.split(":")
-            data["Customer provided ID?"] = False if v == 1 else v
-        if p.startswith("sc"):
-            k, v = p.split(":")
-            data["Session Count"] = int(v)
-        if p.startswith("cs"):
-            k, v = p.split(":")
-            data["Current Session Timestamp"] = datetime.utcfromtimestamp(int(v)).strftime('%Y-%m-%d %H:%M:%S')
-        if p.startswith("fs"):
-            k, v = p.split(":")
-            data["First Session Start Timestamp"] = datetime.utcfromtimestamp(int(v)).strftime('%Y-%m-%d %H:%M:%S')
-        if p.startswith("pv"):
-            k, v = p.split(":")
-            data["Total Pageview Count"] = int(v)
-        if p.startswith("ps"):
-            k, v = p.split(":")
-            data["Previous Session Start Timestamp"] = datetime.utcfromtimestamp(int(v)).strftime('%Y-%m-%d %H:%M:%S')
-        if p.startswith("seg"):
-            k, v = p.split(":")
-            s = v.replace('.', ':')
-            s = re.sub(r'([a-z0-9]+):', r'"\1":', s, flags=re.MULTILINE)
-            j = json.loads(s)
-            data["Segments"] = j
-        if p.startswith("exp"):
-            k, v = p.split(":")
-            s = v.replace('-', ',')
-            s = s.replace('.', ':')
-            s = re.sub(r'([a-z0-9]+):', r'"\1":', s, flags=re.MULTILINE)
-            j = json.loads(s)
-            data["Experiments"] = j
-
-    return data
-
+import importlib
+
+from .cookie import getCookieData, decodeCookies, resolveCookieData, ConvertVisitorCookie
+
+
+# name -> submodule it is loaded from on first access
+_LAZY_ATTRS = {
+    "api": (
+        "API_BASE_URL",
+        "LIST_EXPERIENCES_URL",
+        "LIST_PROJECTS_URL",
+        "GET_EXPERIENCE_URL",
+        "GET_EXPERIENCE_DAILY_REPORT_URL",
+        "GET_EXPERIENCE_AGG_REPORT_URL",
+        "ConvertAPIError",
+        "doRequest",
+        "getAuthSignature",
+        "listProjects",
+        "iterProjects",
+        "listExperiences",
+        "iterExperiences",
+        "getExperience",
+        "getExperienceVariantMaps",
+        "getExperienceStats",
+        "getExperienceDailyReport",
+        "getExperienceAggregatedReport",
+    ),
+    "client": ("ConvertClient", "createSession", "fetchReports"),
+    "aio": ("AsyncConvertClient",),
+    "stream": ("streamExperienceDailyReport", "streamExperienceAggregatedReport"),
+    "sync": ("DailyReportStore", "syncDailyReports"),
+    "snapshot": ("snapshotAccount", "diffSnapshots"),
+    "aggregate": ("CookieAggregator", "HyperLogLog", "aggregateCookies"),
+    "columnar": ("ReportColumns", "reportColumns", "recordColumns"),
+    "stats": ("compareVariations", "stackColumns", "rankExperiences"),
+    "refresher": ("VariantMapRefresher", "AsyncVariantMapRefresher"),
+    "index": ("ExperienceIndex", "ExperienceRecord", "VariationRecord", "GoalRecord", "SegmentRecord",
+              "getExperienceIndex"),
+    "daemon": ("CookieResolver",),
+    "cache": ("MemoryCache", "SQLiteCache", "cacheKey"),
+    "signer": ("RequestSigner", "getSigner"),
+    "singleflight": ("SingleFlight", "AsyncSingleFlight", "SINGLE_FLIGHT"),
+    "retry": ("RetryPolicy", "TokenBucket", "DEFAULT_RETRY_POLICY", "RATE_LIMITER",
+              "setRateLimit", "parseRetryAfter"),
+    "metrics": ("HOOKS", "RequestMetrics", "MetricsRegistry", "Histogram", "addHook", "removeHook"),
+}
+_LAZY = {name: module for module, names in _LAZY_ATTRS.items() for name in names}
+
+
+def __getattr__(name):
+    module = _LAZY.get(name)
+    if module is None:
+        raise AttributeError("module '{}' has no attribute '{}'".format(__name__, name))
+    value = getattr(importlib.import_module("." + module, __name__), name)
+    globals()[name] = value # later lookups skip __getattr__
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
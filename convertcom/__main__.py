@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Command line interface: python -m convertcom <command> ...
+
+One entry point for what the scripts in the repository do, with a batch
+mode: the per-experience commands take any number of experience IDs, and
+the cookie command any number of cookies, as arguments or one per line
+from stdin (or a file with -f). All of them are processed with one
+client, cache and connection pool, and results are written as NDJSON,
+one JSON object per line, as they come in:
+
+    python -m convertcom experiences 10001 10002
+    python -m convertcom stats 10001 10002 < experience_ids.txt
+    python -m convertcom cookie --resolve 10001 10002 < cookies.txt
+    python -m convertcom aggregate -P --state cookies.agg < cookies.txt
+    python -m convertcom snapshot 10001 --diff inventory.json -o inventory.json
+    python -m convertcom serve 10001 10002 --port 8765   # see daemon.py
+
+Credentials default to the CONVERT_APPLICATION_ID and CONVERT_SECRET
+environment variables.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import convertcom
+from .cookie import _checkExperiments
+
+
+log = logging.getLogger()
+
+EXPERIENCE_COMMANDS = {
+    "experience": "getExperience",
+    "stats": "getExperienceStats",
+    "daily": "getExperienceDailyReport",
+    "aggregated": "getExperienceAggregatedReport",
+}
+
+
+def _inputs(values, path):
+    """Yields the arguments given, or else the non-empty lines of `path`
+    (stdin for None or '-')."""
+    if values:
+        yield from values
+        return
+    f = sys.stdin if path in (None, "-") else open(path)
+    try:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _mapOrdered(fn, items, workers):
+    """Like pool.map, but consumes `items` lazily with at most two calls
+    queued per worker."""
+    pool = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for item in items:
+            pending.append((item, pool.submit(fn, item)))
+            if len(pending) >= workers * 2:
+                item, f = pending.popleft()
+                yield item, f.result()
+        while pending:
+            item, f = pending.popleft()
+            yield item, f.result()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _write(out, d):
+    out.write(json.dumps(d))
+    out.write("\n")
+
+
+def _client(args):
+    if not args.applicationId or not args.secret:
+        log.error("Missing API credentials: pass --applicationId and --secret or set "
+                  "CONVERT_APPLICATION_ID and CONVERT_SECRET!")
+        sys.exit(2)
+    cache = convertcom.SQLiteCache(args.cache) if args.cache else convertcom.MemoryCache()
+    return convertcom.ConvertClient(args.applicationId, args.secret, verbose=args.verbose,
+                                    base_url=args.baseUrl, cache=cache,
+                                    pool_maxsize=max(10, args.workers))
+
+
+def cmdExperiences(args, out):
+    with _client(args) as c:
+        try:
+            for e in c.iterExperiences(args.accountId, args.projectId):
+                if args.showAll or e.get("status") == "active":
+                    _write(out, e)
+        except convertcom.ConvertAPIError as e:
+            log.error(str(e))
+            return 1
+    return 0
+
+
+def cmdMaps(args, out):
+    with _client(args) as c:
+        e, v = c.getExperienceVariantMaps(args.accountId, args.projectId)
+    if not e:
+        log.error("Failed to get experience/variant map in account/project {accountId}/{projectId}!".format(
+            accountId=args.accountId, projectId=args.projectId))
+        return 1
+    _write(out, {"experiences": e, "variations": v})
+    return 0
+
+
+def cmdExperience(args, out):
+    failed = 0
+    with _client(args) as c:
+        fn = getattr(c, EXPERIENCE_COMMANDS[args.command])
+        call = lambda i: fn(args.accountId, args.projectId, i)
+        for i, d in _mapOrdered(call, _inputs(args.experienceIds, args.file), args.workers):
+            if d is False:
+                failed += 1
+                _write(out, {"experience_id": i, "error": "request failed"})
+            else:
+                _write(out, {"experience_id": i, args.command: d})
+    return 1 if failed else 0
+
+
+def cmdCookie(args, out):
+    maps = None
+    if args.resolve:
+        with _client(args) as c:
+            maps = c.getExperienceVariantMaps(*args.resolve)
+        if not maps[0]:
+            log.error("Failed to get experience/variant map in account/project {}/{}!".format(*args.resolve))
+            return 1
+
+    failed = 0
+    cookies = _inputs(args.cookies, args.file)
+    for d in convertcom.decodeCookies(cookies, workers=args.workers if args.processes else 1):
+        if d is not None and maps is not None:
+            try:
+                _checkExperiments(d)
+                d = convertcom.resolveCookieData(d, *maps)
+            except ValueError as e:
+                log.warning("Failed to resolve cookie: {}".format(e))
+                d = None
+        if d is None:
+            failed += 1
+        _write(out, d)
+    return 1 if failed else 0
+
+
+def cmdAggregate(args, out):
+    index = None
+    if args.resolve:
+        with _client(args) as c:
+            index = c.getExperienceIndex(*args.resolve)
+        if not index:
+            log.error("Failed to get the experiences of account/project {}/{}!".format(*args.resolve))
+            return 1
+
+    agg = convertcom.aggregateCookies(_inputs(args.cookies, args.file),
+                                      workers=args.workers if args.processes else 1)
+    if args.state:
+        if os.path.exists(args.state):
+            with open(args.state) as f:
+                agg.merge(convertcom.CookieAggregator.from_dict(json.load(f)))
+        with open(args.state + ".tmp", "w") as f:
+            json.dump(agg.to_dict(), f)
+        os.replace(args.state + ".tmp", args.state)
+    _write(out, agg.summary(index))
+    return 0
+
+
+def cmdSnapshot(args, out):
+    previous = None
+    if args.diff and os.path.exists(args.diff):
+        with open(args.diff) as f:
+            previous = json.load(f)
+
+    with _client(args) as c:
+        snap = c.snapshotAccount(args.accountId, project_ids=args.projectIds or None,
+                                 max_workers=args.workers)
+    if not snap:
+        log.error("Failed to list the projects of account {accountId}!".format(accountId=args.accountId))
+        return 1
+
+    if args.output:
+        with open(args.output + ".tmp", "w") as f:
+            json.dump(snap, f)
+        os.replace(args.output + ".tmp", args.output)
+    if args.diff:
+        _write(out, convertcom.diffSnapshots(previous or {}, snap))
+    elif not args.output:
+        _write(out, snap)
+    return 1 if snap["errors"] else 0
+
+
+def cmdServe(args, out):
+    from .daemon import serve
+
+    if not args.applicationId or not args.secret:
+        log.error("Missing API credentials: pass --applicationId and --secret or set "
+                  "CONVERT_APPLICATION_ID and CONVERT_SECRET!")
+        return 2
+    try:
+        serve(args.accountId, args.projectId, host=args.host, port=args.port, socket_path=args.socket,
+              refresh_interval=args.refresh, application_id=args.applicationId, secret=args.secret,
+              verbose=args.verbose, base_url=args.baseUrl, session=convertcom.createSession())
+    except (ValueError, RuntimeError, OSError) as e:
+        # e.g. no maps to start with, or the port or socket path is taken
+        log.error(str(e))
+        return 2
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m convertcom")
+    parser.add_argument('-a', '--applicationId', type=str, default=os.environ.get("CONVERT_APPLICATION_ID"),
+                        help="API application ID (default: $CONVERT_APPLICATION_ID)")
+    parser.add_argument('-s', '--secret', type=str, default=os.environ.get("CONVERT_SECRET"),
+                        help="API secret key (default: $CONVERT_SECRET)")
+    parser.add_argument('--baseUrl', type=str, help="API base URL (default: https://api.convert.com)")
+    parser.add_argument('--cache', type=str, help="SQLite cache file shared between runs")
+    parser.add_argument('-w', '--workers', type=int, default=8, help="concurrent requests (or cookie decoding processes)")
+    parser.add_argument('-v', '--verbose', action='count', default=0)
+    parser.add_argument('-q', '--quiet', action='store_true')
+    commands = parser.add_subparsers(dest="command", metavar="command")
+    commands.required = True
+
+    p = commands.add_parser("experiences", help="list the experiences of a project")
+    p.add_argument('accountId', type=str, help="account ID")
+    p.add_argument('projectId', type=str, help="project ID")
+    p.add_argument('--showAll', action='store_true', help="include paused and archived experiences")
+    p.set_defaults(func=cmdExperiences)
+
+    p = commands.add_parser("maps", help="get the experience/variation key maps of a project")
+    p.add_argument('accountId', type=str, help="account ID")
+    p.add_argument('projectId', type=str, help="project ID")
+    p.set_defaults(func=cmdMaps)
+
+    for name, help in (("experience", "get experiences"),
+                       ("stats", "get experience stats"),
+                       ("daily", "get daily reports"),
+                       ("aggregated", "get aggregated reports")):
+        p = commands.add_parser(name, help=help)
+        p.add_argument('accountId', type=str, help="account ID")
+        p.add_argument('projectId', type=str, help="project ID")
+        p.add_argument('experienceIds', type=str, nargs='*', help="experience IDs (default: read from stdin)")
+        p.add_argument('-f', '--file', type=str, help="read experience IDs from this file")
+        p.set_defaults(func=cmdExperience)
+
+    p = commands.add_parser("cookie", help="decode _conv_v cookies")
+    p.add_argument('cookies', type=str, nargs='*', help="raw _conv_v cookie values (default: read from stdin)")
+    p.add_argument('-f', '--file', type=str, help="read cookies from this file")
+    p.add_argument('-r', '--resolve', type=str, nargs=2, metavar=("ACCOUNT_ID", "PROJECT_ID"),
+                   help="resolve experiment/variation IDs to keys with the API")
+    p.add_argument('-P', '--processes', action='store_true', help="decode across --workers processes")
+    p.set_defaults(func=cmdCookie)
+
+    p = commands.add_parser("aggregate", help="count experiment, variation, goal and visitor totals over _conv_v cookies")
+    p.add_argument('cookies', type=str, nargs='*', help="raw _conv_v cookie values (default: read from stdin)")
+    p.add_argument('-f', '--file', type=str, help="read cookies from this file")
+    p.add_argument('-r', '--resolve', type=str, nargs=2, metavar=("ACCOUNT_ID", "PROJECT_ID"),
+                   help="add experiment/variation keys from the API")
+    p.add_argument('-P', '--processes', action='store_true', help="aggregate across --workers processes")
+    p.add_argument('--state', type=str, help="merge into the aggregate saved in this file, and save it back")
+    p.set_defaults(func=cmdAggregate)
+
+    p = commands.add_parser("snapshot", help="snapshot the projects and experiences of an account")
+    p.add_argument('accountId', type=str, help="account ID")
+    p.add_argument('projectIds', type=str, nargs='*', help="only these projects (default: all)")
+    p.add_argument('-o', '--output', type=str, help="write the snapshot to this file instead of stdout")
+    p.add_argument('--diff', type=str, metavar="PREVIOUS",
+                   help="write the changes since this earlier snapshot file instead")
+    p.set_defaults(func=cmdSnapshot)
+
+    p = commands.add_parser("serve", help="run a local cookie resolution daemon")
+    p.add_argument('accountId', type=str, help="account ID")
+    p.add_argument('projectId', type=str, help="project ID")
+    p.add_argument('--host', type=str, default="127.0.0.1")
+    p.add_argument('--port', type=int, default=8765)
+    p.add_argument('--socket', type=str, help="listen on this Unix socket instead")
+    p.add_argument('--refresh', type=float, default=300, help="seconds between map refreshes")
+    p.set_defaults(func=cmdServe)
+
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s::%(funcName)s(): %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+    )
+    if args.quiet:
+        log.setLevel("ERROR")
+    elif args.verbose > 0:
+        log.setLevel("DEBUG")
+    else:
+        log.setLevel("INFO")
+
+    try:
+        return args.func(args, sys.stdout)
+    except BrokenPipeError:
+        # e.g. piped into head; don't complain about the closed stdout
+        sys.stderr.close()
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
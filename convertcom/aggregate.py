@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Streaming aggregation of _conv_v cookies
+
+A CookieAggregator consumes cookies one at a time and keeps only counts:
+exact counters of cookies per experiment and variation, of goal hits per
+(experiment, variation, goal), and of session counts, plus HyperLogLog
+sketches of the unique visitors ('vi') overall and per variation. Its
+memory depends on the number of experiments, variations and goals seen,
+not on the number of cookies:
+
+    agg = aggregateCookies(open("cookies.txt"), workers=4)
+    agg.summary()
+
+Aggregators are mergeable: aggregateCookies has each worker process
+aggregate a chunk of the input and merges the partial results, and
+aggregates of separate runs (e.g. per day, via to_dict/from_dict) can be
+merged the same way.
+"""
+
+import base64
+import hashlib
+import logging
+import math
+from collections import Counter, deque
+from itertools import islice
+
+from .cookie import ConvertVisitorCookie
+
+
+log = logging.getLogger()
+
+SESSION_CAP = 100 # session counts from here on share one histogram bucket
+
+
+def hashValue(value):
+    """64-bit hash of a string, the same in every process (unlike hash())."""
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HyperLogLog(object):
+    """HyperLogLog cardinality sketch with 2**p one-byte registers; the
+    standard error of estimate() is about 1.04 / sqrt(2**p) (0.8% for the
+    default p=14, in 16 KB).
+    """
+
+    __slots__ = ('p', 'registers')
+
+    def __init__(self, p=14, registers=None):
+        if not 4 <= p <= 18:
+            raise ValueError("HyperLogLog precision must be between 4 and 18, not {}".format(p))
+        self.p = p
+        self.registers = bytearray(registers) if registers is not None else bytearray(1 << p)
+
+    def __repr__(self):
+        return "HyperLogLog(p={}, estimate={:.0f})".format(self.p, self.estimate())
+
+    def add(self, value):
+        self.addHash(hashValue(value))
+
+    def addHash(self, h):
+        """Adds a value by its hashValue()."""
+        bits = 64 - self.p
+        i = h >> bits
+        rank = bits - (h & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[i]:
+            self.registers[i] = rank
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.673 if m == 16 else 0.697 if m == 32 else 0.709 if m == 64 else 0.7213 / (1 + 1.079 / m)
+        e = alpha * m * m / math.fsum(2.0 ** -r for r in self.registers)
+        if e <= 2.5 * m:
+            zeros = self.registers.count(0)
+            if zeros:
+                e = m * math.log(m / zeros) # linear counting for small cardinalities
+        return e
+
+    def merge(self, other):
+        """Adds the values counted by another sketch of the same precision."""
+        if other.p != self.p:
+            raise ValueError("Can't merge HyperLogLog sketches of precision {} and {}".format(self.p, other.p))
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def to_dict(self):
+        return {"p": self.p, "registers": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d["p"], base64.b64decode(d["registers"]))
+
+
+class CookieAggregator(object):
+    """Exact counters and unique visitor sketches over a stream of cookies.
+
+    `p` is the precision of the overall unique visitor sketch and
+    `variation_p` that of the per-variation ones (1 KB each at 10, with a
+    3% standard error). Session counts of SESSION_CAP and up share a
+    histogram bucket.
+
+    Counters are keyed by integer IDs: `variations` by (experiment,
+    variation), `goals` by (experiment, variation, goal), `sessions` by
+    session count. `visitors` and `variation_visitors` hold the sketches.
+    """
+
+    def __init__(self, p=14, variation_p=10):
+        self.p = p
+        self.variation_p = variation_p
+        self.cookies = 0
+        self.malformed = 0
+        self.variations = Counter()
+        self.goals = Counter()
+        self.sessions = Counter()
+        self.visitors = HyperLogLog(p)
+        self.variation_visitors = {}
+
+    def __repr__(self):
+        return "CookieAggregator({} cookies, {} variations, {} goals)".format(
+            self.cookies, len(self.variations), len(self.goals))
+
+    def add(self, cookie):
+        """Counts one cookie (a raw _conv_v string or a ConvertVisitorCookie).
+        A malformed cookie is only counted as such."""
+        try:
+            if isinstance(cookie, str):
+                cookie = ConvertVisitorCookie(cookie)
+            # check the whole exp map before counting anything
+            buckets = []
+            for e, d in (cookie.experiments or {}).items():
+                if not isinstance(d, dict) or "v" not in d:
+                    continue
+                v = d["v"]
+                goals = d.get("g") or {}
+                if not isinstance(v, int) or not isinstance(goals, dict):
+                    raise ValueError("Malformed experiment '{}'".format(e))
+                buckets.append(((int(e), v), [int(g) for g in goals]))
+        except ValueError as e:
+            log.debug("Failed to decode cookie '%s': %s", cookie, e)
+            self.malformed += 1
+            return
+
+        self.cookies += 1
+        h = hashValue(str(cookie.visitorId)) if cookie.visitorId else None
+        if h is not None:
+            self.visitors.addHash(h)
+        if cookie.sessionCount is not None:
+            self.sessions[min(cookie.sessionCount, SESSION_CAP)] += 1
+
+        for bucket, goals in buckets:
+            self.variations[bucket] += 1
+            if h is not None:
+                sketch = self.variation_visitors.get(bucket)
+                if sketch is None:
+                    sketch = self.variation_visitors[bucket] = HyperLogLog(self.variation_p)
+                sketch.addHash(h)
+            for g in goals:
+                self.goals[bucket + (g,)] += 1
+
+    def update(self, cookies):
+        """Counts every cookie of an iterable; returns self."""
+        for c in cookies:
+            self.add(c)
+        return self
+
+    def merge(self, other):
+        """Adds the counts of another aggregator (of the same precisions);
+        returns self."""
+        self.cookies += other.cookies
+        self.malformed += other.malformed
+        self.variations.update(other.variations)
+        self.goals.update(other.goals)
+        self.sessions.update(other.sessions)
+        self.visitors.merge(other.visitors)
+        for bucket, sketch in other.variation_visitors.items():
+            mine = self.variation_visitors.get(bucket)
+            if mine is None:
+                self.variation_visitors[bucket] = HyperLogLog(sketch.p, sketch.registers)
+            else:
+                mine.merge(sketch)
+        return self
+
+    def summary(self, index=None):
+        """Returns the aggregate as a JSON-ready dict:
+
+            {"cookies", "malformed", "unique_visitors",
+             "sessions": {session count: cookies, ..., "<SESSION_CAP>+": cookies},
+             "experiments": {experiment id: {"cookies", "variations": {variation id:
+                 {"cookies", "unique_visitors", "goals": {goal id: hits}}}}}}
+
+        Unique visitor counts are estimates. With an ExperienceIndex, the
+        experiments and variations it knows get a "key" as well.
+        """
+        experiments = {}
+        for (e, v), n in sorted(self.variations.items()):
+            exp = experiments.get(str(e))
+            if exp is None:
+                exp = experiments[str(e)] = {"cookies": 0, "variations": {}}
+                if index is not None and e in index.experiences:
+                    exp["key"] = index.experiences[e].key
+            exp["cookies"] += n
+            sketch = self.variation_visitors.get((e, v))
+            var = exp["variations"][str(v)] = {
+                "cookies": n,
+                "unique_visitors": round(sketch.estimate()) if sketch is not None else 0,
+                "goals": {},
+            }
+            if index is not None and v in index.variations:
+                var["key"] = index.variations[v].key
+        for (e, v, g), n in sorted(self.goals.items()):
+            experiments[str(e)]["variations"][str(v)]["goals"][str(g)] = n
+
+        sessions = {}
+        for sc, n in sorted(self.sessions.items()):
+            sessions[str(sc) if sc < SESSION_CAP else "{}+".format(SESSION_CAP)] = n
+        return {
+            "cookies": self.cookies,
+            "malformed": self.malformed,
+            "unique_visitors": round(self.visitors.estimate()),
+            "sessions": sessions,
+            "experiments": experiments,
+        }
+
+    def to_dict(self):
+        """Returns the full state (with sketches) as a JSON-ready dict, for
+        from_dict and merging later."""
+        return {
+            "p": self.p,
+            "variation_p": self.variation_p,
+            "cookies": self.cookies,
+            "malformed": self.malformed,
+            "variations": [[e, v, n] for (e, v), n in self.variations.items()],
+            "goals": [[e, v, g, n] for (e, v, g), n in self.goals.items()],
+            "sessions": [[sc, n] for sc, n in self.sessions.items()],
+            "visitors": self.visitors.to_dict(),
+            "variation_visitors": [[e, v, s.to_dict()] for (e, v), s in self.variation_visitors.items()],
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        agg = cls(d["p"], d["variation_p"])
+        agg.cookies = d["cookies"]
+        agg.malformed = d["malformed"]
+        agg.variations = Counter({(e, v): n for e, v, n in d["variations"]})
+        agg.goals = Counter({(e, v, g): n for e, v, g, n in d["goals"]})
+        agg.sessions = Counter({sc: n for sc, n in d["sessions"]})
+        agg.visitors = HyperLogLog.from_dict(d["visitors"])
+        agg.variation_visitors = {(e, v): HyperLogLog.from_dict(s) for e, v, s in d["variation_visitors"]}
+        return agg
+
+
+def _aggregateChunk(cookies, p, variation_p):
+    return CookieAggregator(p, variation_p).update(cookies)
+
+
+def aggregateCookies(cookies, workers=None, chunksize=10000, p=14, variation_p=10):
+    """Aggregates an iterable of cookie strings into one CookieAggregator.
+
+    Cookies are read `chunksize` at a time and aggregated by a pool of
+    `workers` processes (default: one per CPU; 1 aggregates in this
+    process), whose partial aggregates are merged as they come back. At
+    most two chunks per worker are in flight, so memory use doesn't grow
+    with the input.
+    """
+    import multiprocessing
+
+    total = CookieAggregator(p, variation_p)
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1:
+        return total.update(cookies)
+
+    cookies = iter(cookies)
+    chunks = iter(lambda: list(islice(cookies, chunksize)), [])
+    pool = multiprocessing.Pool(workers)
+    try:
+        maxPending = workers * 2
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_aggregateChunk, (chunk, p, variation_p)))
+            if len(pending) >= maxPending:
+                total.merge(pending.popleft().get())
+        while pending:
+            total.merge(pending.popleft().get())
+    finally:
+        pool.terminate()
+    return total
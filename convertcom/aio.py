@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""asyncio client for the Convert.com API
+
+AsyncConvertClient mirrors the convertcom API functions as coroutines, so
+many calls can be fanned out concurrently with asyncio.gather:
+
+    async with AsyncConvertClient(application_id, secret) as c:
+        stats = await asyncio.gather(*[
+            c.getExperienceStats(account_id, project_id, i) for i in ids])
+
+Requests are built and signed exactly like the blocking functions, and
+responses are unwrapped the same way. Requires aiohttp.
+"""
+
+import asyncio
+import json
+import logging
+import time
+import traceback
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .api import (
+    _handleResponse,
+    _singleFlightKey,
+    _listExperiencesRequest,
+    _listExperiencesPageRequest,
+    _nextPage,
+    _getExperienceRequest,
+    _getExperienceStatsRequest,
+    _getExperienceDailyReportRequest,
+    _getExperienceAggregatedReportRequest,
+    _buildExperienceVariantMaps,
+    _VARIANT_MAPS_BODY_PARAMS,
+    ConvertAPIError,
+)
+from .cache import cacheKey
+from .signer import getSigner
+from .singleflight import AsyncSingleFlight
+from .retry import DEFAULT_RETRY_POLICY, RATE_LIMITER, parseRetryAfter
+from .metrics import HOOKS, RequestMetrics, emit
+
+
+log = logging.getLogger()
+
+
+def _metricsTraceConfig():
+    """Returns an aiohttp TraceConfig that fills in the connect time and
+    TTFB of the RequestMetrics passed as a request's trace_request_ctx.
+    """
+    async def onRequestStart(session, ctx, params):
+        ctx.started = time.perf_counter()
+
+    async def onConnectionCreateStart(session, ctx, params):
+        ctx.connectStarted = time.perf_counter()
+
+    async def onConnectionCreateEnd(session, ctx, params):
+        m = ctx.trace_request_ctx
+        if m is not None:
+            m.connect_time = (m.connect_time or 0) + time.perf_counter() - ctx.connectStarted
+
+    async def onRequestEnd(session, ctx, params):
+        # called once the response headers have been read
+        m = ctx.trace_request_ctx
+        if m is not None:
+            m.ttfb = time.perf_counter() - ctx.started
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(onRequestStart)
+    trace.on_connection_create_start.append(onConnectionCreateStart)
+    trace.on_connection_create_end.append(onConnectionCreateEnd)
+    trace.on_request_end.append(onRequestEnd)
+    return trace
+
+
+class AsyncConvertClient(object):
+    """Convert.com API client whose methods are coroutines.
+
+    `limit` caps the total number of open connections and `limit_per_host`
+    the number of connections to api.convert.com, which also bounds how
+    many requests are in flight at once. `base_url` replaces
+    https://api.convert.com, e.g. to run against a local stand-in server.
+    `cache` works as for ConvertClient and may be shared with one.
+    `retry` (a RetryPolicy) and `rate_limiter` (a TokenBucket) replace the
+    shared defaults from retry.py. With `singleflight`, identical
+    concurrent calls are coalesced into one request.
+    """
+
+    def __init__(self, application_id, secret, verbose=0, base_url=None, session=None, cache=None,
+                 retry=None, rate_limiter=None, singleflight=True,
+                 limit=100, limit_per_host=20):
+        if aiohttp is None:
+            raise ImportError("AsyncConvertClient requires the 'aiohttp' package")
+
+        self.application_id = application_id
+        self.secret = secret
+        self.signer = getSigner(application_id, secret)
+        self.verbose = verbose
+        self.base_url = base_url
+        self.cache = cache
+        self.retry = retry
+        self.rate_limiter = rate_limiter
+        self._singleflight = AsyncSingleFlight() if singleflight else None
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+
+        self._ownsSession = session is None
+        self.session = session
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """Closes the underlying session, if this client created it."""
+        if self._ownsSession and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def _getSession(self):
+        # aiohttp sessions must be created inside a running event loop
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host),
+                trace_configs=[_metricsTraceConfig()])
+        return self.session
+
+    def _kwargs(self, kwargs):
+        opts = {
+            "application_id": self.application_id,
+            "secret": self.secret,
+            "signer": self.signer,
+            "verbose": self.verbose,
+            "base_url": self.base_url,
+
+            "retry": self.retry,
+            "rate_limiter": self.rate_limiter,
+        }
+        opts.update(kwargs)
+        return opts
+
+    async def _cached(self, endpoint, fetch, account_id, project_id, experience_id=None, body=""):
+        """Awaits fetch() through this client's cache, if it has one."""
+        if self.cache is None:
+            return await fetch()
+
+        key = cacheKey(endpoint, account_id, project_id, experience_id, body)
+        d = self.cache.get(key)
+        if d is None:
+            if self._singleflight is not None:
+                d = await self._singleflight.do(("cache",) + key, fetch)
+            else:
+                d = await fetch()
+            if d is not False:
+                self.cache.set(key, d)
+            elif hasattr(self.cache, 'getStale'):
+                stale = self.cache.getStale(key)
+                if stale is not None:
+                    log.warning("Serving stale cache entry for {}".format(key))
+                    d = stale
+        return d
+
+    async def doRequest(self, url, method, extra_headers, **opts):
+        """Performs the actual call to Convert.com API, with the same rate
+        limiting and retries as convertcom.doRequest. Identical concurrent
+        requests made through this client are coalesced into one.
+        """
+        if self._singleflight is None or opts.get('singleflight') is False:
+            return await self._doRequest(url, method, extra_headers, **opts)
+
+        key = _singleFlightKey(url, method, extra_headers, **opts)
+        return await self._singleflight.do(
+            key, lambda: self._doRequest(url, method, extra_headers, **opts))
+
+    async def _doRequest(self, url, method, extra_headers, **opts):
+        verbose = opts.get('verbose', 0)
+        getData = opts.get('get_data', False)
+        headers = {'content-type': 'application/json'}
+        params = opts.get('params', {})
+        body = opts.get('body', "")
+        retry = opts.get('retry') or DEFAULT_RETRY_POLICY
+        limiter = opts.get('rate_limiter') or RATE_LIMITER
+        signer = opts.get('signer')
+
+        if extra_headers:
+            headers.update(extra_headers)
+
+        if method not in ('GET', 'POST'):
+            raise ValueError('Undefined HTTP method "{}"'.format(method))
+
+        m = None
+        if HOOKS:
+            m = RequestMetrics(opts.get('endpoint'), method, url, opts.get('sign_time'))
+            started = time.perf_counter()
+
+        log.debug("Making '%s' request to URL (%s) with headers: %s", method, url, headers)
+        content = None
+        attempt = 0
+        try:
+            while True:
+                await limiter.acquireAsync()
+                try:
+                    async with self._getSession().request(
+                            method, url, headers=headers, params=params, data=body,
+                            trace_request_ctx=m) as r:
+                        content = await r.read()
+                        status = r.status
+                        contentType = r.headers.get("content-type", "")
+                        retryAfter = parseRetryAfter(r.headers.get("Retry-After"))
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    if not retry.shouldRetry(attempt):
+                        raise
+                    delay = retry.delay(attempt)
+                    log.warning("{} request to '{}' failed with error: {}; retrying in {:.2f}s".format(
+                        method, url, e, delay))
+                else:
+                    if not retry.shouldRetry(attempt, status, retryAfter):
+                        break
+                    if status == 429 and retryAfter:
+                        limiter.pause(retryAfter) # hold back every other caller too
+                    delay = retry.delay(attempt, retryAfter)
+                    log.warning("Received status code '{}' making {} request to '{}'; retrying in {:.2f}s".format(
+                        status, method, url, delay))
+
+                await asyncio.sleep(delay)
+                attempt += 1
+                if signer is not None:
+                    headers.update(signer.headers(url, body))
+
+            d = None
+            if status != 204 and contentType.strip().startswith("application/json"):
+                if m is not None:
+                    decodeStarted = time.perf_counter()
+                    d = json.loads(content)
+                    m.decode_time = time.perf_counter() - decodeStarted
+                else:
+                    d = json.loads(content)
+
+            return _handleResponse(method, url, status, d, content,
+                                   getData=getData, verbose=verbose)
+        except Exception as e:
+            if m is not None:
+                m.error = repr(e)
+            log.error("Failed to do {} request to '{}' with error: {}".format(
+                method, url, e))
+            log.error("Request error contet: {}".format(str(content)))
+            log.error(traceback.format_exc())
+        finally:
+            if m is not None:
+                m.retries = attempt
+                if content is not None:
+                    m.status = status
+                    m.response_bytes = len(content)
+                m.total_time = time.perf_counter() - started
+                emit(m)
+        return False
+
+    async def listExperiences(self, account_id, project_id, **kwargs):
+        async def fetch():
+            u, method, headers, opts = _listExperiencesRequest(
+                account_id, project_id, **self._kwargs(kwargs))
+            return await self.doRequest(u, method, headers, **opts)
+
+        body = json.dumps(kwargs['bodyParams']) if kwargs.get('bodyParams') else ""
+        return await self._cached("listExperiences", fetch, account_id, project_id, body=body)
+
+    async def iterExperiences(self, account_id, project_id, **kwargs):
+        """Async generator over the experiences of a project, across all pages.
+
+        The next page is requested while the caller works through the
+        current one. Raises ConvertAPIError if a page can't be fetched.
+        """
+        async def fetch(page):
+            u, method, headers, opts = _listExperiencesPageRequest(
+                account_id, project_id, page, **self._kwargs(kwargs))
+            return await self.doRequest(u, method, headers, **opts)
+
+        page = 1
+        task = asyncio.ensure_future(fetch(page))
+        try:
+            while task is not None:
+                d = await task
+                if not d:
+                    raise ConvertAPIError("Failed to list page {page} of experiences in account/project {accountId}/{projectId}!".format(
+                        page=page, accountId=account_id, projectId=project_id))
+
+                task = None
+                nextPage = _nextPage(d, page)
+                if nextPage:
+                    page = nextPage
+                    task = asyncio.ensure_future(fetch(page))
+
+                for e in d["data"]:
+                    yield e
+        finally:
+            if task is not None:
+                task.cancel()
+
+    async def getExperience(self, account_id, project_id, experience_id, **kwargs):
+        async def fetch():
+            u, method, headers, opts = _getExperienceRequest(
+                account_id, project_id, experience_id, **self._kwargs(kwargs))
+            return await self.doRequest(u, method, headers, **opts)
+
+        return await self._cached("getExperience", fetch, account_id, project_id, experience_id)
+
+    async def getExperienceVariantMaps(self, account_id, project_id, **kwargs):
+        """Returns a tuple of dicts: the first is a dict of experience id/key-name pairs,
+        and the second is a dict of variant keys indexed by id.
+        """
+        async def fetch():
+            d = []
+            try:
+                async for e in self.iterExperiences(account_id, project_id,
+                                                    bodyParams=_VARIANT_MAPS_BODY_PARAMS, **kwargs):
+                    d.append(e)
+            except ConvertAPIError as e:
+                log.error(str(e))
+                return False # lets _cached fall back to a stale entry
+            return _buildExperienceVariantMaps(d)
+
+        d = await self._cached("getExperienceVariantMaps", fetch, account_id, project_id)
+        return (False, False) if d is False else tuple(d)
+
+    async def getExperienceStats(self, account_id, project_id, experience_id, **kwargs):
+        u, method, headers, opts = _getExperienceStatsRequest(
+            account_id, project_id, experience_id, **self._kwargs(kwargs))
+        return await self.doRequest(u, method, headers, **opts)
+
+    async def getExperienceDailyReport(self, account_id, project_id, experience_id, **kwargs):
+        u, method, headers, opts = _getExperienceDailyReportRequest(
+            account_id, project_id, experience_id, **self._kwargs(kwargs))
+        return await self.doRequest(u, method, headers, **opts)
+
+    async def getExperienceAggregatedReport(self, account_id, project_id, experience_id, **kwargs):
+        u, method, headers, opts = _getExperienceAggregatedReportRequest(
+            account_id, project_id, experience_id, **self._kwargs(kwargs))
+        return await self.doRequest(u, method, headers, **opts)
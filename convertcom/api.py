@@ -0,0 +1,567 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Functions for the Convert.com REST API
+
+Every function here makes its calls with requests, signing them with the
+application_id/secret kwargs. They are importable from the convertcom
+package, which only loads this module (and requests) on first use.
+"""
+
+import json
+import logging
+import traceback
+
+import hmac
+import hashlib
+import binascii
+
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import requests
+from urllib.parse import urlencode
+
+from .cache import cacheKey
+from .signer import getSigner
+from .singleflight import SINGLE_FLIGHT
+from .retry import DEFAULT_RETRY_POLICY, RATE_LIMITER, parseRetryAfter
+from .metrics import HOOKS, RequestMetrics, emit
+
+
+log = logging.getLogger()
+
+API_BASE_URL = "https://api.convert.com"
+
+LIST_EXPERIENCES_URL = "https://api.convert.com/api/v2/accounts/{account_id}/projects/{project_id}/experiences"
+LIST_PROJECTS_URL = "https://api.convert.com/api/v2/accounts/{account_id}/projects"
+GET_EXPERIENCE_URL = "https://api.convert.com/api/v2/accounts/{account_id}/projects/{project_id}/experiences/{experience_id}"
+GET_EXPERIENCE_DAILY_REPORT_URL = "https://api.convert.com/api/v2/accounts/{account_id}/projects/{project_id}/experiences/{experience_id}/daily_report"
+GET_EXPERIENCE_AGG_REPORT_URL = "https://api.convert.com/api/v2/accounts/{account_id}/projects/{project_id}/experiences/{experience_id}/aggregated_report"
+#GET_VARIATIONS_URL = "https://api.convert.com/api/v2/accounts/{account_id}/projects/{project_id}/experiences/{experience_id}/variations/{variation_id}"
+
+
+class ConvertAPIError(Exception):
+    """Raised where a failed API call can't be reported by returning False
+    (e.g. from inside a generator)."""
+
+
+def doRequest(url, method, extra_headers, **opts):
+    """Performs the actual call to Convert.com API
+
+    Each attempt first waits for the 'rate_limiter' opt (default: the shared
+    RATE_LIMITER), and failed attempts are retried according to the 'retry'
+    opt (default: DEFAULT_RETRY_POLICY). With a 'signer' opt, retries are
+    re-signed once the original signature gets close to expiring.
+
+    Identical concurrent requests (same application ID, method, url and
+    body) are coalesced through the 'singleflight' opt (default: the shared
+    SINGLE_FLIGHT; False disables it), so only one of them goes out.
+
+    With the 'stream' opt, a successful JSON response is returned as the
+    unread requests.Response, for the caller to decode incrementally (see
+    stream.py).
+
+    While a metrics hook is registered (see metrics.py), every request
+    reports a RequestMetrics to it.
+    """
+    group = opts.get('singleflight')
+    if group is False or opts.get('stream'):
+        return _doRequest(url, method, extra_headers, **opts)
+    if group is None:
+        group = SINGLE_FLIGHT
+
+    key = _singleFlightKey(url, method, extra_headers, **opts)
+    return group.do(key, lambda: _doRequest(url, method, extra_headers, **opts))
+
+
+def _singleFlightKey(url, method, extra_headers=None, **opts):
+    # Requests made with different credentials must not share a response
+    signer = opts.get('signer')
+    applicationId = (extra_headers or {}).get("Convert-Application-ID") or \
+        (signer.application_id if signer is not None else None)
+    params = opts.get('params') or {}
+    return (applicationId, method, url, opts.get('body', ""), bool(opts.get('get_data')),
+            tuple(sorted(params.items())))
+
+
+def _doRequest(url, method, extra_headers, **opts):
+    """Makes the request for doRequest, with rate limiting and retries."""
+    verbose = opts.get('verbose', 0)
+    getData = opts.get('get_data', False)
+    headers = {'content-type': 'application/json'}
+    params = opts.get('params', {})
+    body = opts.get('body', "")
+    session = opts.get('session') or requests # pooled session, if the caller has one
+    retry = opts.get('retry') or DEFAULT_RETRY_POLICY
+    limiter = opts.get('rate_limiter') or RATE_LIMITER
+    signer = opts.get('signer')
+    stream = opts.get('stream', False)
+
+    if extra_headers:
+        headers.update(extra_headers)
+
+    m = None
+    if HOOKS:
+        m = RequestMetrics(opts.get('endpoint'), method, url, opts.get('sign_time'))
+        started = time.perf_counter()
+
+    log.debug("Making '%s' request to URL (%s) with headers: %s", method, url, headers)
+    r = None
+    attempt = 0
+    try:
+        while True:
+            limiter.acquire()
+            try:
+                if method == 'GET':
+                    r = session.get(url, headers=headers, params=params, data=body, stream=stream)
+                elif method == 'POST':
+                    r = session.post(url, headers=headers, params=params, data=body, stream=stream)
+                # TODO add DEL
+                else:
+                    raise ValueError('Undefined HTTP method "{}"'.format(method))
+            except requests.exceptions.RequestException as e:
+                if not retry.shouldRetry(attempt):
+                    raise
+                delay = retry.delay(attempt)
+                log.warning("{} request to '{}' failed with error: {}; retrying in {:.2f}s".format(
+                    method, url, e, delay))
+            else:
+                retryAfter = parseRetryAfter(r.headers.get("Retry-After"))
+                if not retry.shouldRetry(attempt, r.status_code, retryAfter):
+                    break
+                r.close()
+                if r.status_code == 429 and retryAfter:
+                    limiter.pause(retryAfter) # hold back every other caller too
+                delay = retry.delay(attempt, retryAfter)
+                log.warning("Received status code '{}' making {} request to '{}'; retrying in {:.2f}s".format(
+                    r.status_code, method, url, delay))
+
+            time.sleep(delay)
+            attempt += 1
+            if signer is not None:
+                headers.update(signer.headers(url, body))
+
+        if m is not None:
+            m.status = r.status_code
+            m.ttfb = r.elapsed.total_seconds()
+
+        d = None
+        if r.status_code != 204 and \
+                r.headers["content-type"].strip().startswith("application/json"):
+            if stream and r.status_code >= 200 and r.status_code <= 202:
+                return r # the caller decodes the body as it arrives
+            if m is not None:
+                m.response_bytes = len(r.content)
+                decodeStarted = time.perf_counter()
+                d = r.json()
+                m.decode_time = time.perf_counter() - decodeStarted
+            else:
+                d = r.json()
+
+        return _handleResponse(method, url, r.status_code, d, r.content,
+                              getData=getData, verbose=verbose)
+    except Exception as e:
+        if m is not None:
+            m.error = repr(e)
+        log.error("Failed to do {} request to '{}' with error: {}".format(
+            method, url, e))
+        log.error("Request error contet: {}".format(str(r.content) if r is not None else None))
+        log.error(traceback.format_exc())
+    finally:
+        if m is not None:
+            m.retries = attempt
+            if m.response_bytes is None and r is not None and not stream:
+                m.response_bytes = len(r.content)
+            m.total_time = time.perf_counter() - started
+            emit(m)
+    return False
+
+
+def _handleResponse(method, url, status_code, d, content, getData=False, verbose=0):
+    """Unwraps a decoded Convert.com API response.
+
+    `d` is the decoded JSON body (or None if the response was not JSON).
+    Returns the response (or its 'data' field when getData is set) on
+    success, otherwise logs the error and returns False.
+    """
+    if d is not None:
+        log.debug("Response (%s): %s", status_code, d)
+        if verbose > 1 and log.isEnabledFor(logging.DEBUG):
+            log.debug(json.dumps(d, indent=2))
+
+        if status_code >= 200 and status_code <= 202:
+            if verbose > 1:
+                log.debug("Success!")
+            return d["data"] if getData else d
+
+    if status_code >= 400 and d != None:
+        if d["isError"]:
+            log.error("Received an error response ({}) making {} request to '{}': {}".format(
+                status_code, method, url, d["message"]))
+        else:
+            log.error("Received bad status code '{}' when making {} request to '{}': {}".format(
+                status_code, method, url, content))
+    elif d == None:
+        log.error("Unknown response ({}) when making {} request to url '{}': {}".format(
+            status_code, method, url, content))
+    return False
+
+
+def getAuthSignature(application_id, expires_timestamp, url, body, secret, **kwargs):
+    """
+    """
+    verbose = kwargs.get('verbose', 0)
+    signStr = "{appId}\n{expires}\n{url}\n{body}".format(
+	appId=application_id, expires=expires_timestamp, url=url, body=body)
+
+    msg = bytes(signStr, 'utf-8')
+    secret = bytes(secret, 'utf-8')
+    if verbose > 0:
+        log.debug("Signstr: {}".format(signStr))
+
+    signature = str(binascii.hexlify(hmac.new(
+        secret, msg,
+        digestmod=hashlib.sha256
+    ).digest()), 'ascii')
+
+    log.debug("Signature: \"%s\"", signature)
+    return signature
+
+
+def _formatUrl(template, base_url=None, **ids):
+    """Fills in an API URL template, optionally swapping API_BASE_URL for
+    `base_url` (e.g. to point the client at a local stand-in server).
+    """
+    u = template.format(**ids)
+    if base_url:
+        u = base_url.rstrip('/') + u[len(API_BASE_URL):]
+    return u
+
+
+def _prepareRequest(template, method, body, ids, get_data=False, **kwargs):
+    """Builds and signs an API request, using the 'signer' kwarg or a
+    shared RequestSigner for the application_id/secret kwargs.
+
+    Returns a (url, method, headers, opts) tuple that can be passed
+    straight to doRequest (or AsyncConvertClient.doRequest).
+    """
+    verbose = kwargs.get('verbose', 0)
+
+    u = _formatUrl(template, kwargs.get('base_url'), **ids)
+
+    signStarted = time.perf_counter() if HOOKS else None
+    signer = kwargs.get('signer') or getSigner(kwargs.get('application_id'), kwargs.get('secret'))
+    headers = signer.headers(u, body, verbose=verbose)
+
+    opts = {
+        "endpoint": template, # for metrics
+        "sign_time": time.perf_counter() - signStarted if signStarted is not None else None,
+        "verbose": verbose,
+        "body": body,
+        "session": kwargs.get('session'),
+        "signer": signer,
+        "retry": kwargs.get('retry'),
+        "rate_limiter": kwargs.get('rate_limiter'),
+        "singleflight": kwargs.get('singleflight'),
+        "get_data": get_data # return the 'data' field from response data
+    }
+    return (u, method, headers, opts)
+
+
+def _cached(endpoint, fetch, account_id, project_id, experience_id=None, body="", **kwargs):
+    """Returns fetch() through the 'cache' kwarg, if one was given.
+    Failed (False) results are never cached; if the cache supports it, a
+    recently expired entry is served instead.
+    """
+    cache = kwargs.get('cache')
+    if cache is None:
+        return fetch()
+
+    key = cacheKey(endpoint, account_id, project_id, experience_id, body)
+    d = cache.get(key)
+    if d is None:
+        group = kwargs.get('singleflight')
+        if group is None:
+            group = SINGLE_FLIGHT
+        signer = kwargs.get('signer')
+        applicationId = signer.application_id if signer is not None else kwargs.get('application_id')
+        d = group.do(("cache", applicationId) + key, fetch) if group else fetch()
+        if d is not False:
+            cache.set(key, d)
+        elif hasattr(cache, 'getStale'):
+            stale = cache.getStale(key)
+            if stale is not None:
+                log.warning("Serving stale cache entry for {}".format(key))
+                d = stale
+    else:
+        log.debug("Cache hit for %s", key)
+    return d
+
+
+def _listProjectsRequest(account_id, page=None, **kwargs):
+    bodyParams = dict(kwargs.get('bodyParams') or {})
+    if page is not None:
+        bodyParams['page'] = page
+    body = json.dumps(bodyParams) if bodyParams else ""
+
+    return _prepareRequest(LIST_PROJECTS_URL, 'POST', body, {
+        "account_id": account_id
+    }, get_data=page is None, **kwargs)
+
+
+def listProjects(account_id, **kwargs):
+    """Returns a single page of the projects of an account. Use
+    iterProjects to walk all of them.
+    """
+    def fetch():
+        u, method, headers, opts = _listProjectsRequest(account_id, **kwargs)
+        return doRequest(u, method, headers, **opts)
+
+    body = json.dumps(kwargs['bodyParams']) if kwargs.get('bodyParams') else ""
+    return _cached("listProjects", fetch, account_id, None, body=body, **kwargs)
+
+
+def iterProjects(account_id, **kwargs):
+    """Yields the projects of an account, across all pages. Raises
+    ConvertAPIError if a page can't be fetched.
+    """
+    page = 1
+    while page:
+        u, method, headers, opts = _listProjectsRequest(account_id, page, **kwargs)
+        d = doRequest(u, method, headers, **opts)
+        if not d:
+            raise ConvertAPIError("Failed to list page {page} of projects in account {accountId}!".format(
+                page=page, accountId=account_id))
+        for p in d["data"]:
+            yield p
+        page = _nextPage(d, page)
+
+
+def _listExperiencesRequest(account_id, project_id, **kwargs):
+    # Body params?
+    body = ""
+    if kwargs.get('bodyParams', False):
+        body = json.dumps(kwargs.get('bodyParams'))
+
+    return _prepareRequest(LIST_EXPERIENCES_URL, 'POST', body, {
+        "account_id": account_id,
+        "project_id": project_id
+    }, get_data=True, **kwargs)
+
+
+def listExperiences(account_id, project_id, **kwargs):
+    """Returns a single page of experiences (the first, unless a 'page' is
+    given in bodyParams). Use iterExperiences to walk all of them.
+    """
+    def fetch():
+        u, method, headers, opts = _listExperiencesRequest(account_id, project_id, **kwargs)
+        return doRequest(u, method, headers, **opts)
+
+    body = json.dumps(kwargs['bodyParams']) if kwargs.get('bodyParams') else ""
+    return _cached("listExperiences", fetch, account_id, project_id, body=body, **kwargs)
+
+
+def _listExperiencesPageRequest(account_id, project_id, page, **kwargs):
+    bodyParams = dict(kwargs.pop('bodyParams', None) or {})
+    bodyParams['page'] = page
+    if kwargs.get('results_per_page'):
+        bodyParams['results_per_page'] = kwargs['results_per_page']
+
+    u, method, headers, opts = _listExperiencesRequest(
+        account_id, project_id, bodyParams=bodyParams, **kwargs)
+    opts['get_data'] = False # we need the pagination info as well
+    return (u, method, headers, opts)
+
+
+def _nextPage(d, page):
+    """Returns the page number following `page` according to the pagination
+    info of the listing response `d`, or None if `page` was the last one.
+    """
+    pagination = (d.get('extra') or {}).get('pagination') or {}
+    pagesCount = pagination.get('pages_count')
+    if pagesCount and page < int(pagesCount):
+        return page + 1
+    return None
+
+
+def iterExperiences(account_id, project_id, **kwargs):
+    """Yields the experiences of a project one at a time, across all pages.
+
+    While the caller works through a page, the next one is fetched in a
+    background thread, so at most two pages are held in memory. Accepts the
+    same kwargs as listExperiences, plus an optional 'results_per_page'.
+    Raises ConvertAPIError if a page can't be fetched.
+    """
+    def fetch(page):
+        u, method, headers, opts = _listExperiencesPageRequest(
+            account_id, project_id, page, **kwargs)
+        return doRequest(u, method, headers, **opts)
+
+    pool = ThreadPoolExecutor(max_workers=1)
+    try:
+        page = 1
+        future = pool.submit(fetch, page)
+        while future is not None:
+            d = future.result()
+            if not d:
+                raise ConvertAPIError("Failed to list page {page} of experiences in account/project {accountId}/{projectId}!".format(
+                    page=page, accountId=account_id, projectId=project_id))
+
+            future = None
+            nextPage = _nextPage(d, page)
+            if nextPage:
+                page = nextPage
+                future = pool.submit(fetch, page)
+
+            for e in d["data"]:
+                yield e
+    finally:
+        pool.shutdown(wait=False)
+
+
+# We want variation data to be expanded
+_GET_EXPERIENCE_BODY = json.dumps({
+    'include': ["variations"],
+    'expand': ["variations"]
+})
+
+def _getExperienceRequest(account_id, project_id, experience_id, **kwargs):
+    return _prepareRequest(GET_EXPERIENCE_URL, 'GET', _GET_EXPERIENCE_BODY, {
+        "account_id": account_id,
+        "project_id": project_id,
+        "experience_id": experience_id
+    }, **kwargs)
+
+
+def getExperience(account_id, project_id, experience_id, **kwargs):
+    def fetch():
+        u, method, headers, opts = _getExperienceRequest(account_id, project_id, experience_id, **kwargs)
+        return doRequest(u, method, headers, **opts)
+
+    return _cached("getExperience", fetch, account_id, project_id, experience_id, **kwargs)
+
+
+#def listVariations(account_id, project_id, experience_id, **kwargs):
+#    https://api.convert.com/api/v2/accounts/{account_id}/projects/{project_id}/experiences/{experience_id}/variations/{variation_id}/update
+
+_VARIANT_MAPS_BODY_PARAMS = {
+    'include': ["variations"],
+    'expand': ["variations"]
+}
+
+def getExperienceVariantMaps(account_id, project_id, **kwargs):
+    """Returns a tuple of dicts: the first is a dict of experience id/key-name pairs,
+    and the second is a dict of variant keys indexed by id.
+    """
+    def fetch():
+        try:
+            return _buildExperienceVariantMaps(iterExperiences(
+                account_id, project_id, bodyParams=_VARIANT_MAPS_BODY_PARAMS, **kwargs))
+        except ConvertAPIError as e:
+            log.error(str(e))
+            return False # lets _cached fall back to a stale entry
+
+    d = _cached("getExperienceVariantMaps", fetch, account_id, project_id, **kwargs)
+    return (False, False) if d is False else tuple(d)
+
+
+def _buildExperienceVariantMaps(d):
+    """Builds the (experience map, variant map) tuple returned by
+    getExperienceVariantMaps from an iterable of expanded experiences.
+    """
+    eMap = {}
+    vMap = {}
+    for e in d:
+        i = str(e['id'])
+        n = e['name']
+        k = e['key']
+
+        eMap.update({i: k})
+
+        for v in e['variations']:
+            vi = str(v['id'])
+            vk = v['key']
+
+            if i not in vMap:
+                vMap.update({i: {}})
+            vMap[i].update({vi: vk})
+
+    return (eMap, vMap)
+
+
+# We want variation data to be expanded
+_GET_EXPERIENCE_STATS_BODY = json.dumps({
+    'include': ["variations", "stats"],
+    'expand': ["variations"]
+})
+
+def _getExperienceStatsRequest(account_id, project_id, experience_id, **kwargs):
+    return _prepareRequest(GET_EXPERIENCE_URL, 'GET', _GET_EXPERIENCE_STATS_BODY, {
+        "account_id": account_id,
+        "project_id": project_id,
+        "experience_id": experience_id
+    }, **kwargs)
+
+
+def getExperienceStats(account_id, project_id, experience_id, **kwargs):
+    u, method, headers, opts = _getExperienceStatsRequest(account_id, project_id, experience_id, **kwargs)
+    return doRequest(u, method, headers, **opts)
+
+
+def _getExperienceDailyReportRequest(account_id, project_id, experience_id, **kwargs):
+    # Body params? (e.g. a start_time/end_time range, see sync.py)
+    body = ""
+    if kwargs.get('bodyParams', False):
+        body = json.dumps(kwargs.get('bodyParams'))
+
+    # We want variation data to be expanded
+    """
+    body = json.dumps({
+        'include': ["variations", "stats"],
+        'expand': ["variations"]
+    })
+    """
+
+    return _prepareRequest(GET_EXPERIENCE_DAILY_REPORT_URL, 'POST', body, {
+        "account_id": account_id,
+        "project_id": project_id,
+        "experience_id": experience_id
+    }, get_data=True, **kwargs)
+
+
+def getExperienceDailyReport(account_id, project_id, experience_id, **kwargs):
+    u, method, headers, opts = _getExperienceDailyReportRequest(account_id, project_id, experience_id, **kwargs)
+    return doRequest(u, method, headers, **opts)
+
+
+_GET_EXPERIENCE_AGG_REPORT_BODY = json.dumps({
+    'metrics': ["conversion_rate", "avg_revenue_visitor", "avg_products_ordered_visitor"],
+})
+
+def _getExperienceAggregatedReportRequest(account_id, project_id, experience_id, **kwargs):
+    return _prepareRequest(GET_EXPERIENCE_AGG_REPORT_URL, 'POST', _GET_EXPERIENCE_AGG_REPORT_BODY, {
+        "account_id": account_id,
+        "project_id": project_id,
+        "experience_id": experience_id
+    }, get_data=True, **kwargs)
+
+
+def getExperienceAggregatedReport(account_id, project_id, experience_id, **kwargs):
+    u, method, headers, opts = _getExperienceAggregatedReportRequest(account_id, project_id, experience_id, **kwargs)
+    return doRequest(u, method, headers, **opts)
+
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Response caches for the read-only API endpoints
+
+listExperiences, getExperience and getExperienceVariantMaps take an
+optional `cache` kwarg (ConvertClient has a matching `cache` option). A
+cache is any object with these methods:
+
+    get(key)        -> cached value, or None on a miss/expired entry
+    set(key, value) -> None
+    invalidate(endpoint=None, account_id=None, project_id=None, experience_id=None)
+
+Keys are (endpoint, account_id, project_id, experience_id, body) tuples of
+strings, where endpoint is the API function name. Cached values are shared
+between callers and must not be modified.
+
+MemoryCache lives in a single process; SQLiteCache keeps entries on local
+disk so that many short-lived processes can share them.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+log = logging.getLogger()
+
+DEFAULT_TTLS = {
+    "listExperiences": 60,
+    "getExperience": 60,
+    "getExperienceVariantMaps": 300,
+}
+
+
+def cacheKey(endpoint, account_id, project_id, experience_id=None, body=""):
+    return (endpoint, str(account_id), str(project_id),
+            "" if experience_id is None else str(experience_id), body)
+
+
+def keyMatches(key, endpoint=None, account_id=None, project_id=None, experience_id=None):
+    """Whether a cache key is covered by an invalidate() call's filters."""
+    for k, f in zip(key, (endpoint, account_id, project_id, experience_id)):
+        if f is not None and k != str(f):
+            return False
+    return True
+
+
+class MemoryCache(object):
+    """Thread-safe in-process LRU cache with per-endpoint TTLs.
+
+    `ttls` maps endpoint names to a lifetime in seconds and overrides
+    DEFAULT_TTLS; endpoints not listed there use `ttl`. At most `maxsize`
+    entries are kept, evicting the least recently used one first.
+    """
+
+    def __init__(self, maxsize=256, ttl=60, ttls=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+
+        self._entries = OrderedDict() # key -> (expires, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttls.get(key[0], self.ttl)
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, endpoint=None, account_id=None, project_id=None, experience_id=None):
+        """Drops every entry matching the given filters (all entries if none
+        are given)."""
+        with self._lock:
+            for key in [k for k in self._entries
+                        if keyMatches(k, endpoint, account_id, project_id, experience_id)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteCache(object):
+    """Cache stored in a SQLite database, shared by every process using the
+    same file.
+
+    Entries are keyed by endpoint, account, project, experience and request
+    body, and written with a single INSERT OR REPLACE, so a refresh is atomic
+    and readers in other processes see either the old or the new value. The
+    database runs in WAL mode, so readers don't block each other or the
+    writer.
+
+    `ttls`/`ttl` work as for MemoryCache. An expired entry is a miss, unless
+    `stale_ttl` is set: then entries up to `stale_ttl` seconds past their
+    expiry are still served by getStale(), e.g. to fall back on when the
+    API can't be reached.
+    """
+
+    def __init__(self, path, ttl=60, ttls=None, stale_ttl=0, timeout=30):
+        self.path = path
+        self.ttl = ttl
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS entries (
+                endpoint TEXT NOT NULL,
+                account_id TEXT NOT NULL,
+                project_id TEXT NOT NULL,
+                experience_id TEXT NOT NULL,
+                body TEXT NOT NULL,
+                expires REAL NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (endpoint, account_id, project_id, experience_id, body)
+            )""")
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads (or processes),
+        # so keep one per thread and reopen it after a fork
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=self.timeout)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def _get(self, key, maxAge):
+        row = self._connect().execute(
+            """SELECT value FROM entries WHERE endpoint=? AND account_id=? AND project_id=?
+               AND experience_id=? AND body=? AND expires > ?""",
+            tuple(key) + (time.time() - maxAge,)).fetchone()
+        if row is None:
+            return None
+        return _decodeValue(key[0], row[0])
+
+    def get(self, key):
+        return self._get(key, 0)
+
+    def getStale(self, key):
+        """Like get(), but also serves entries expired less than stale_ttl
+        seconds ago."""
+        return self._get(key, self.stale_ttl)
+
+    def set(self, key, value):
+        expires = time.time() + self.ttls.get(key[0], self.ttl)
+        with self._connect() as db:
+            db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       tuple(key) + (expires, json.dumps(value)))
+
+    def invalidate(self, endpoint=None, account_id=None, project_id=None, experience_id=None):
+        where = []
+        args = []
+        for column, f in (("endpoint", endpoint), ("account_id", account_id),
+                          ("project_id", project_id), ("experience_id", experience_id)):
+            if f is not None:
+                where.append("{}=?".format(column))
+                args.append(str(f))
+
+        with self._connect() as db:
+            db.execute("DELETE FROM entries" + (" WHERE " + " AND ".join(where) if where else ""), args)
+
+    def purge(self):
+        """Deletes entries that are past their expiry (and stale_ttl)."""
+        with self._connect() as db:
+            db.execute("DELETE FROM entries WHERE expires <= ?", (time.time() - self.stale_ttl,))
+
+    def clear(self):
+        self.invalidate()
+
+
+def _decodeValue(endpoint, value):
+    d = json.loads(value)
+    if endpoint == "getExperienceVariantMaps":
+        d = tuple(d) # JSON has no tuples
+    return d
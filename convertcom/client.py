@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Object-oriented client for the Convert.com API
+
+A ConvertClient holds the API credentials and a single pooled
+requests.Session, so repeated calls reuse keep-alive connections to
+api.convert.com instead of paying a TCP/TLS handshake per request.
+fetchReports fans report calls for many experiences out over such a
+session with a bounded thread pool.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .api import (
+    listProjects,
+    iterProjects,
+    listExperiences,
+    iterExperiences,
+    getExperience,
+    getExperienceVariantMaps,
+    getExperienceStats,
+    getExperienceDailyReport,
+    getExperienceAggregatedReport,
+)
+from .signer import getSigner
+from .stream import streamExperienceDailyReport, streamExperienceAggregatedReport
+from .sync import syncDailyReports
+from .snapshot import snapshotAccount
+from .index import getExperienceIndex
+
+
+log = logging.getLogger()
+
+
+def createSession(pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True):
+    """Returns a requests.Session with a tuned connection pool.
+
+    pool_connections is the number of per-host pools to keep, pool_maxsize
+    the maximum number of connections kept open to a single host.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=pool_maxsize,
+        pool_block=pool_block)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    if not keep_alive:
+        session.headers.update({"Connection": "close"})
+    return session
+
+
+REPORT_FUNCTIONS = {
+    "stats": getExperienceStats,
+    "daily": getExperienceDailyReport,
+    "aggregated": getExperienceAggregatedReport,
+}
+
+def fetchReports(account_id, project_id, experience_ids, kinds=("stats", "daily", "aggregated"),
+                 max_workers=8, **kwargs):
+    """Fetches reports for many experiences concurrently.
+
+    Runs one call per (experience, kind) pair through a pool of max_workers
+    threads sharing one HTTP session (the 'session' kwarg, or a new one sized
+    to the pool), and yields (experience_id, kind, result) tuples in the
+    order the calls complete. As with the single-experience functions, a
+    failed call yields False as its result. `experience_ids` may be any
+    iterable; it is consumed lazily.
+    """
+    for kind in kinds:
+        if kind not in REPORT_FUNCTIONS:
+            raise ValueError('Unknown report kind "{}"'.format(kind))
+
+    session = kwargs.pop('session', None)
+    ownsSession = session is None
+    if ownsSession:
+        session = createSession(pool_maxsize=max_workers)
+
+    def calls():
+        for experience_id in experience_ids:
+            for kind in kinds:
+                yield (experience_id, kind)
+
+    pending = {}
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        todo = calls()
+        exhausted = False
+        while True:
+            # keep at most two calls queued per worker
+            while not exhausted and len(pending) < max_workers * 2:
+                call = next(todo, None)
+                if call is None:
+                    exhausted = True
+                    break
+                experience_id, kind = call
+                f = pool.submit(REPORT_FUNCTIONS[kind], account_id, project_id, experience_id,
+                                session=session, **kwargs)
+                pending[f] = call
+            if not pending:
+                break
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                experience_id, kind = pending.pop(f)
+                yield (experience_id, kind, f.result())
+    finally:
+        for f in pending:
+            f.cancel()
+        pool.shutdown(wait=True)
+        if ownsSession:
+            session.close()
+
+
+class ConvertClient(object):
+    """Convert.com API client sharing one pooled HTTP session across calls.
+
+    `base_url` replaces https://api.convert.com, e.g. to run against a local
+    stand-in server. `cache` (e.g. a MemoryCache) is used in front of
+    listExperiences, getExperience and getExperienceVariantMaps.
+    `retry` (a RetryPolicy) and `rate_limiter` (a TokenBucket) replace the
+    shared defaults from retry.py.
+
+    Usage:
+        with ConvertClient(application_id, secret) as c:
+            for e in c.listExperiences(account_id, project_id):
+                ...
+    """
+
+    def __init__(self, application_id, secret, verbose=0, base_url=None, session=None, cache=None,
+                 retry=None, rate_limiter=None,
+                 pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True):
+        self.application_id = application_id
+        self.secret = secret
+        self.signer = getSigner(application_id, secret)
+        self.verbose = verbose
+        self.base_url = base_url
+        self.cache = cache
+        self.retry = retry
+        self.rate_limiter = rate_limiter
+
+        self._ownsSession = session is None
+        if session is None:
+            session = createSession(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                pool_block=pool_block,
+                keep_alive=keep_alive)
+        self.session = session
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Closes the underlying session, if this client created it."""
+        if self._ownsSession:
+            self.session.close()
+
+    def invalidate(self, endpoint=None, account_id=None, project_id=None, experience_id=None):
+        """Drops matching entries from this client's cache, if it has one."""
+        if self.cache is not None:
+            self.cache.invalidate(endpoint=endpoint, account_id=account_id,
+                                  project_id=project_id, experience_id=experience_id)
+
+    def _kwargs(self, kwargs):
+        opts = {
+            "application_id": self.application_id,
+            "secret": self.secret,
+            "signer": self.signer,
+            "verbose": self.verbose,
+            "base_url": self.base_url,
+            "session": self.session,
+            "cache": self.cache,
+
+            "retry": self.retry,
+            "rate_limiter": self.rate_limiter,
+        }
+        opts.update(kwargs)
+        return opts
+
+    def listProjects(self, account_id, **kwargs):
+        return listProjects(account_id, **self._kwargs(kwargs))
+
+    def iterProjects(self, account_id, **kwargs):
+        return iterProjects(account_id, **self._kwargs(kwargs))
+
+    def listExperiences(self, account_id, project_id, **kwargs):
+        return listExperiences(account_id, project_id, **self._kwargs(kwargs))
+
+    def iterExperiences(self, account_id, project_id, **kwargs):
+        return iterExperiences(account_id, project_id, **self._kwargs(kwargs))
+
+    def getExperience(self, account_id, project_id, experience_id, **kwargs):
+        return getExperience(account_id, project_id, experience_id, **self._kwargs(kwargs))
+
+    def getExperienceVariantMaps(self, account_id, project_id, **kwargs):
+        return getExperienceVariantMaps(account_id, project_id, **self._kwargs(kwargs))
+
+    def getExperienceIndex(self, account_id, project_id, **kwargs):
+        return getExperienceIndex(account_id, project_id, **self._kwargs(kwargs))
+
+    def getExperienceStats(self, account_id, project_id, experience_id, **kwargs):
+        return getExperienceStats(account_id, project_id, experience_id, **self._kwargs(kwargs))
+
+    def getExperienceDailyReport(self, account_id, project_id, experience_id, **kwargs):
+        return getExperienceDailyReport(account_id, project_id, experience_id, **self._kwargs(kwargs))
+
+    def getExperienceAggregatedReport(self, account_id, project_id, experience_id, **kwargs):
+        return getExperienceAggregatedReport(account_id, project_id, experience_id, **self._kwargs(kwargs))
+
+    def streamExperienceDailyReport(self, account_id, project_id, experience_id, **kwargs):
+        return streamExperienceDailyReport(account_id, project_id, experience_id, **self._kwargs(kwargs))
+
+    def streamExperienceAggregatedReport(self, account_id, project_id, experience_id, **kwargs):
+        return streamExperienceAggregatedReport(account_id, project_id, experience_id, **self._kwargs(kwargs))
+
+    def fetchReports(self, account_id, project_id, experience_ids, kinds=("stats", "daily", "aggregated"),
+                     max_workers=8, **kwargs):
+        """See fetchReports(); calls share this client's session, so its
+        pool_maxsize should be at least max_workers."""
+        return fetchReports(account_id, project_id, experience_ids, kinds=kinds,
+                            max_workers=max_workers, **self._kwargs(kwargs))
+
+    def syncDailyReports(self, account_id, project_id, experience_ids, store, recheck_days=2,
+                         max_workers=4, **kwargs):
+        """See sync.syncDailyReports(); calls share this client's session."""
+        return syncDailyReports(account_id, project_id, experience_ids, store,
+                                recheck_days=recheck_days, max_workers=max_workers,
+                                **self._kwargs(kwargs))
+
+    def snapshotAccount(self, account_id, project_ids=None, max_workers=8, **kwargs):
+        """See snapshot.snapshotAccount(); calls share this client's session."""
+        return snapshotAccount(account_id, project_ids=project_ids, max_workers=max_workers,
+                               **self._kwargs(kwargs))
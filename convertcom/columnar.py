@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Columnar (NumPy) form of experience reports
+
+reportColumns turns the output of getExperienceDailyReport or
+getExperienceAggregatedReport into one 2-D array per metric, indexed by
+(variation, day), so totals, rates and cumulative series are array
+operations instead of walks over the JSON tree:
+
+    c = reportColumns(convertcom.getExperienceDailyReport(...))
+    c.variation_ids              # row -> variation ID
+    c.days                       # column -> day (datetime64[D])
+    c.totals("conversions")      # per variation
+    c.rate("conversions", "visitors")
+
+recordColumns does the same for flat day records, as yielded by
+streamExperienceDailyReport or returned by DailyReportStore.rows.
+
+Numeric fields of a day entry become metrics; nested objects are
+flattened into dotted names (e.g. "goals.10001841.conversions"). Missing
+values are NaN. Requires numpy.
+"""
+
+import logging
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+log = logging.getLogger()
+
+# Day field of a report's day entries (see sync.DAY_FIELD)
+DAY_FIELD = "date"
+
+
+def _requireNumpy():
+    if np is None:
+        raise ImportError("convertcom.columnar requires the 'numpy' package")
+
+
+def _flatten(d, prefix="", out=None):
+    """Returns the numeric leaves of a nested dict as {dotted name: value}."""
+    if out is None:
+        out = {}
+    for k, v in d.items():
+        name = prefix + str(k)
+        if isinstance(v, dict):
+            _flatten(v, name + ".", out)
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[name] = v
+    return out
+
+
+def _day(v):
+    if isinstance(v, str) and len(v) >= 10:
+        return v[:10]
+    if isinstance(v, (int, float)) and not isinstance(v, bool):
+        return str(np.datetime64(int(v), "s").astype("datetime64[D]"))
+    return None
+
+
+class ReportColumns(object):
+    """Per-metric arrays of shape (len(variation_ids), len(days)).
+
+    `variation_ids` is an int64 array mapping row to variation ID (use
+    index() for the reverse), `days` a datetime64[D] array mapping column
+    to day, or None for a report without days (e.g. an aggregated report;
+    arrays then have a single column). `variation_keys` maps row to
+    variation key where the report includes them.
+    """
+
+    def __init__(self, variation_ids, days, metrics, variation_keys=None):
+        self.variation_ids = variation_ids
+        self.days = days
+        self.metrics = metrics
+        self.variation_keys = variation_keys
+        self._rows = {int(v): i for i, v in enumerate(variation_ids)}
+
+    def __getitem__(self, metric):
+        return self.metrics[metric]
+
+    def __contains__(self, metric):
+        return metric in self.metrics
+
+    def __repr__(self):
+        return "ReportColumns({} variations x {} days: {})".format(
+            len(self.variation_ids), 1 if self.days is None else len(self.days),
+            ", ".join(sorted(self.metrics)))
+
+    @property
+    def shape(self):
+        return (len(self.variation_ids), 1 if self.days is None else len(self.days))
+
+    def index(self, variation_id):
+        """Returns the row of a variation."""
+        return self._rows[int(variation_id)]
+
+    def totals(self, metric):
+        """Sum over all days, per variation."""
+        return np.nansum(self.metrics[metric], axis=1)
+
+    def cumulative(self, metric):
+        """Running total over the days, per variation (missing days add 0)."""
+        return np.nancumsum(self.metrics[metric], axis=1)
+
+    def last(self, metric):
+        """The value of the last day that has one, per variation (NaN if
+        none does), e.g. last("totals") for a running total metric."""
+        a = self.metrics[metric]
+        present = ~np.isnan(a)
+        cols = a.shape[1] - 1 - np.argmax(present[:, ::-1], axis=1)
+        out = a[np.arange(a.shape[0]), cols]
+        out[~present.any(axis=1)] = np.nan
+        return out
+
+    def rate(self, numerator, denominator, cumulative=False):
+        """numerator / denominator per variation and day (NaN where the
+        denominator is 0); with `cumulative`, the running rate instead."""
+        num = self.cumulative(numerator) if cumulative else self.metrics[numerator]
+        den = self.cumulative(denominator) if cumulative else self.metrics[denominator]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(den != 0, num / den, np.nan)
+
+    def totalRate(self, numerator, denominator):
+        """Rate over all days, per variation."""
+        num = self.totals(numerator)
+        den = self.totals(denominator)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(den != 0, num / den, np.nan)
+
+
+def recordColumns(records, variation_keys=None):
+    """Builds ReportColumns from flat day records carrying a 'variation_id'
+    (as yielded by streamExperienceDailyReport). `variation_keys` may map
+    variation IDs to keys.
+    """
+    _requireNumpy()
+
+    rows = {}
+    cols = {}
+    cells = [] # (row, col, flattened values)
+    for r in records:
+        vid = int(r["variation_id"])
+        row = rows.setdefault(vid, len(rows))
+        day = _day(r.get(DAY_FIELD))
+        col = cols.setdefault(day, len(cols))
+        cells.append((row, col, _flatten(r)))
+
+    # order rows by variation ID and columns by day
+    variationIds = sorted(rows)
+    rowOrder = {rows[v]: i for i, v in enumerate(variationIds)}
+    if list(cols) == [None]:
+        days = None
+        colOrder = {0: 0}
+    else:
+        dayList = sorted(d for d in cols if d is not None)
+        if None in cols:
+            log.warning("Dropping report entries without a '{}'".format(DAY_FIELD))
+        colOrder = {cols[d]: i for i, d in enumerate(dayList)}
+        days = np.array(dayList, dtype="datetime64[D]")
+
+    shape = (len(variationIds), 1 if days is None else len(days))
+    metrics = {}
+    for row, col, values in cells:
+        col = colOrder.get(col)
+        if col is None:
+            continue
+        row = rowOrder[row]
+        for name, v in values.items():
+            a = metrics.get(name)
+            if a is None:
+                a = metrics[name] = np.full(shape, np.nan)
+            a[row, col] = v
+    metrics.pop("variation_id", None)
+
+    keys = None
+    if variation_keys:
+        keys = [variation_keys.get(v, variation_keys.get(str(v))) for v in variationIds]
+    return ReportColumns(np.array(variationIds, dtype=np.int64), days, metrics, keys)
+
+
+def _reportRecords(report):
+    for v in (report.get("reportData") or {}).get("variations") or []:
+        stats = v.get("stats")
+        if isinstance(stats, dict):
+            stats = [stats] # aggregated report: a single entry
+        for day in stats or []:
+            if isinstance(day, dict):
+                record = dict(day)
+                record["variation_id"] = v["id"]
+                yield record
+
+
+def reportColumns(report):
+    """Builds ReportColumns from a getExperienceDailyReport or
+    getExperienceAggregatedReport result (or a whole response with it
+    under 'data').
+    """
+    _requireNumpy()
+    if "reportData" not in report and isinstance(report.get("data"), dict):
+        report = report["data"]
+
+    keys = {v["id"]: v.get("key") for v in report.get("variations_data") or [] if "id" in v}
+    return recordColumns(_reportRecords(report), variation_keys=keys or None)
@@ -0,0 +1,355 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Parser for Convert.com's _conv_v visitor cookie
+
+Example cookie value:
+vi:1*sc:2*cs:1374079443*fs:1374074823*pv:4*seg:{100246.1}*exp:{10001236.{v.10008683-g.{10001841.1}}-10001237.{v.10008687-g.{10001841.1}}}*ps:1374074823
+
+Parts are separated by '*' and are 'key:value' pairs. The seg and exp
+values are nested maps: '{' key '.' value ('-' key '.' value)* '}', where
+a value is either another map or an integer.
+
+decodeCookies decodes large streams of cookies across a process pool.
+
+Only the standard library modules that parsing a single cookie needs are
+imported up front; urllib.parse, json and multiprocessing are imported
+where they are first needed, to keep the import cheap for short-lived
+processes.
+"""
+
+import logging
+import time
+from collections import deque
+from itertools import islice
+
+
+log = logging.getLogger()
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+
+def formatTimestamp(ts):
+    """Formats a unix timestamp (UTC) the way getCookieData reports it."""
+    return time.strftime(TIMESTAMP_FORMAT, time.gmtime(ts))
+
+
+def parseCookieMap(s):
+    """Parses a seg/exp cookie value such as '{100246.1}' into nested dicts
+    with string keys and integer leaves.
+    """
+    root = None
+    cur = None
+    key = None
+    stack = []
+    # '.' and '-' only separate keys from values and pairs from each other,
+    # so the map splits into '{', '}', key and value tokens. (str.replace is
+    # several times faster than an equivalent multi-character str.translate.)
+    tokens = s.replace('{', ' { ').replace('}', ' } ').replace('.', ' ').replace('-', ' ').split()
+    for t in tokens:
+        if t == '{':
+            d = {}
+            if cur is not None and key is not None:
+                cur[key] = d
+                stack.append(cur)
+            elif root is None:
+                root = d
+            else:
+                raise ValueError("Malformed cookie value: {}".format(s))
+            cur = d
+            key = None
+        elif t == '}':
+            if cur is None or key is not None:
+                raise ValueError("Malformed cookie value: {}".format(s))
+            cur = stack.pop() if stack else None
+        elif cur is None:
+            raise ValueError("Malformed cookie value: {}".format(s))
+        elif key is None:
+            key = t
+        else:
+            cur[key] = int(t)
+            key = None
+
+    if root is None or cur is not None:
+        raise ValueError("Malformed cookie value: {}".format(s))
+    return root
+
+
+def _customerId(v):
+    return False if v == 1 else v
+
+def _timestamp(v):
+    return formatTimestamp(int(v))
+
+# cookie key -> (getCookieData key, value decoder)
+COOKIE_FIELDS = {
+    "vi": ("Customer provided ID?", _customerId),
+    "sc": ("Session Count", int),
+    "cs": ("Current Session Timestamp", _timestamp),
+    "fs": ("First Session Start Timestamp", _timestamp),
+    "pv": ("Total Pageview Count", int),
+    "ps": ("Previous Session Start Timestamp", _timestamp),
+    "seg": ("Segments", parseCookieMap),
+    "exp": ("Experiments", parseCookieMap),
+}
+
+
+def getCookieData(cookieStr):
+    """Decodes a (possibly URL-encoded) _conv_v cookie value into a dict."""
+    if ":" not in cookieStr:
+        from urllib.parse import unquote
+        cookieStr = unquote(cookieStr)
+        log.debug("Unquoted cookie: %s", cookieStr)
+
+    data = {}
+    for p in cookieStr.split("*"):
+        k, _, v = p.partition(":")
+        field = COOKIE_FIELDS.get(k)
+        if field is not None:
+            data[field[0]] = field[1](v)
+
+    return data
+
+
+# Variation ID a cookie holds for a visitor excluded from an experience
+EXCLUDED_VARIATION = "1"
+
+def _checkExperiments(data):
+    """Raises ValueError if an experiment entry of getCookieData output
+    isn't a map (e.g. from 'exp:{1001.5}'), which the cookie parser lets
+    through."""
+    for i, d in (data.get("Experiments") or {}).items():
+        if not isinstance(d, dict):
+            raise ValueError("Malformed entry for experience id '{}'".format(i))
+
+
+def resolveCookieData(data, eMap, vMap):
+    """Replaces the experiment and variation IDs in getCookieData output
+    with their keys, using the maps from getExperienceVariantMaps.
+
+    Experiments become '<key> (<id>)' entries with the goals ('g') and the
+    variation key ('v'), or '*Excluded*' for an excluded visitor. IDs
+    missing from the maps, and entries that aren't maps, are logged and
+    left out; if none resolve, the experiments are left as they were.
+    Returns a new dict.
+    """
+    r = {}
+    experiments = data.get("Experiments") or {}
+    for i, d in experiments.items():
+        if not isinstance(d, dict):
+            log.warning("Skipping malformed entry for experience id '{}'!".format(i))
+            continue
+        if i not in eMap:
+            log.warning("Could not find experience id '{}' in experience map!".format(i))
+            continue
+
+        k = "{} ({})".format(eMap[i], i)
+        r[k] = {
+            "g": d.get("g", {}),
+            "v": {}
+        } # copy goals
+        dv = str(d.get("v"))
+        variations = vMap.get(i) or {}
+        if dv in variations:
+            r[k]["v"] = variations[dv]
+        elif dv == EXCLUDED_VARIATION:
+            r[k]["v"] = "*Excluded*"
+        else:
+            log.warning("Could not find variant id '{}' in variant map for experience '{}'!".format(
+                dv, i))
+
+    data = dict(data)
+    if r:
+        data["Experiments"] = r
+    return data
+
+
+class ConvertVisitorCookie(object):
+    """Compact, lazily decoded _conv_v cookie.
+
+    Parsing only splits the cookie and converts the integer fields; the seg
+    and exp maps are decoded on first access of `segments`/`experiments`,
+    and timestamps are only formatted when asked for. Use
+    experimentVariations() when only the experiment/variation pairs are
+    needed: it skips building the goal maps altogether.
+
+    to_dict() returns the same dict as getCookieData.
+    """
+
+    __slots__ = ('visitorId', 'sessionCount', 'pageviewCount',
+                 'currentSession', 'firstSession', 'previousSession',
+                 '_segments', '_experiments')
+
+    def __init__(self, cookieStr):
+        if ":" not in cookieStr:
+            from urllib.parse import unquote
+            cookieStr = unquote(cookieStr)
+
+        self.visitorId = None
+        self.sessionCount = None
+        self.pageviewCount = None
+        self.currentSession = None # unix timestamps
+        self.firstSession = None
+        self.previousSession = None
+        self._segments = None # raw string until decoded
+        self._experiments = None
+
+        for p in cookieStr.split("*"):
+            k, _, v = p.partition(":")
+            if k == "exp":
+                self._experiments = v
+            elif k == "seg":
+                self._segments = v
+            elif k == "vi":
+                self.visitorId = _customerId(v)
+            elif k == "sc":
+                self.sessionCount = int(v)
+            elif k == "pv":
+                self.pageviewCount = int(v)
+            elif k == "cs":
+                self.currentSession = int(v)
+            elif k == "fs":
+                self.firstSession = int(v)
+            elif k == "ps":
+                self.previousSession = int(v)
+
+    def __repr__(self):
+        return "ConvertVisitorCookie(visitorId={!r}, sessionCount={!r}, pageviewCount={!r})".format(
+            self.visitorId, self.sessionCount, self.pageviewCount)
+
+    @property
+    def segments(self):
+        """Segment map ({segment id: value}), or None if not in the cookie."""
+        if isinstance(self._segments, str):
+            self._segments = parseCookieMap(self._segments)
+        return self._segments
+
+    @property
+    def experiments(self):
+        """Experiment map ({experiment id: {"v": variation id, "g": {goal id: value}}}),
+        or None if not in the cookie."""
+        if isinstance(self._experiments, str):
+            self._experiments = parseCookieMap(self._experiments)
+        return self._experiments
+
+    def experimentVariations(self):
+        """Returns {experiment id: variation id}, with integer IDs."""
+        if not isinstance(self._experiments, str):
+            return {int(e): d["v"] for e, d in (self._experiments or {}).items() if "v" in d}
+
+        # Walk the tokens of the raw exp map, only picking up the experiment
+        # keys (depth 1) and their 'v' values (depth 2).
+        pairs = {}
+        depth = 0
+        key = None
+        exp = None
+        s = self._experiments
+        for t in s.replace('{', ' { ').replace('}', ' } ').replace('.', ' ').replace('-', ' ').split():
+            if t == '{':
+                if depth == 1:
+                    exp = key
+                depth += 1
+                key = None
+            elif t == '}':
+                depth -= 1
+            elif key is None:
+                key = t
+            else:
+                if depth == 2 and key == 'v':
+                    pairs[int(exp)] = int(t)
+                key = None
+        if depth != 0:
+            raise ValueError("Malformed cookie value: {}".format(s))
+        return pairs
+
+    @property
+    def currentSessionTime(self):
+        return None if self.currentSession is None else formatTimestamp(self.currentSession)
+
+    @property
+    def firstSessionTime(self):
+        return None if self.firstSession is None else formatTimestamp(self.firstSession)
+
+    @property
+    def previousSessionTime(self):
+        return None if self.previousSession is None else formatTimestamp(self.previousSession)
+
+    def to_dict(self):
+        """Returns the cookie as getCookieData would."""
+        data = {}
+        for k, v in (("Customer provided ID?", self.visitorId),
+                     ("Session Count", self.sessionCount),
+                     ("Current Session Timestamp", self.currentSessionTime),
+                     ("First Session Start Timestamp", self.firstSessionTime),
+                     ("Total Pageview Count", self.pageviewCount),
+                     ("Segments", self.segments),
+                     ("Experiments", self.experiments),
+                     ("Previous Session Start Timestamp", self.previousSessionTime)):
+            if v is not None:
+                data[k] = v
+        return data
+
+
+def _decodeChunk(cookies, ndjson=False):
+    if ndjson:
+        import json
+    out = []
+    for c in cookies:
+        try:
+            d = getCookieData(c)
+        except ValueError as e:
+            log.warning("Failed to decode cookie '{}': {}".format(c, e))
+            d = None
+        out.append(json.dumps(d) if ndjson else d)
+    return out
+
+
+def decodeCookies(cookies, workers=None, chunksize=1000, ndjson=False):
+    """Decodes an iterable of cookie strings, yielding the results in input
+    order.
+
+    Cookies are read `chunksize` at a time and decoded by a pool of
+    `workers` processes (default: one per CPU; 1 decodes in this process).
+    At most two chunks per worker are in flight, so memory use doesn't grow
+    with the input. Each result is getCookieData's dict, or None if the
+    cookie couldn't be decoded; with ndjson set, results are JSON strings
+    instead, which are cheaper to pass back from the workers.
+    """
+    import multiprocessing
+
+    cookies = iter(cookies)
+    chunks = iter(lambda: list(islice(cookies, chunksize)), [])
+
+    workers = workers or multiprocessing.cpu_count()
+    if workers == 1:
+        for chunk in chunks:
+            yield from _decodeChunk(chunk, ndjson)
+        return
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        maxPending = workers * 2
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_decodeChunk, (chunk, ndjson)))
+            if len(pending) >= maxPending:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+    finally:
+        pool.terminate()
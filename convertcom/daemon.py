@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Local cookie resolution daemon
+
+Keeps a project's experience/variation maps in memory, refreshes them in
+the background (see refresher.py), and resolves _conv_v cookies over HTTP
+on a local TCP port or Unix socket, returning what
+read_conv_v_cookie_resolve.py prints (see cookie.resolveCookieData):
+
+    python -m convertcom serve 10001 10002 --port 8765
+    python -m convertcom serve 10001 10002 --socket /run/convertcom.sock
+
+Endpoints:
+
+    GET  /resolve?cookie=<url-encoded cookie>  -> JSON object
+    POST /resolve  (one cookie per line)       -> NDJSON, one object per line
+    GET  /health                               -> map size and age
+    POST /refresh                              -> refetch the maps now
+
+A cookie that can't be decoded gives a 400 (or a null line in a batch).
+"""
+
+import json
+import logging
+import os
+import signal
+import socketserver
+import stat
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from .cookie import EXCLUDED_VARIATION, getCookieData, resolveCookieData, _checkExperiments
+from .refresher import VariantMapRefresher
+
+
+log = logging.getLogger()
+
+
+class CookieResolver(object):
+    """Resolves cookies against in-memory experience/variation maps of one
+    project, kept fresh by a VariantMapRefresher: refetched every
+    `refresh_interval` seconds, and early when a cookie carries an
+    experience or variation the maps don't know. Lookups never wait for
+    the API: until a refresh succeeds, the previous maps keep being used.
+    kwargs go to the VariantMapRefresher (application_id, secret, session,
+    miss_interval, ...).
+    """
+
+    def __init__(self, account_id, project_id, refresh_interval=300, **kwargs):
+        self.account_id = account_id
+        self.project_id = project_id
+        self.maps = VariantMapRefresher(account_id, project_id, interval=refresh_interval, **kwargs)
+
+    def refresh(self):
+        """Refetches the maps in the calling thread; returns whether that succeeded."""
+        return self.maps.refresh()
+
+    def start(self):
+        """Fetches the maps, then keeps refreshing them in the background.
+        Raises RuntimeError if the first fetch fails."""
+        if not self.refresh():
+            raise RuntimeError("Can't start without the experience/variant maps")
+        self.maps.start(wait=False)
+        return self
+
+    def stop(self):
+        self.maps.stop()
+
+    def requestRefresh(self):
+        """Makes the background thread refresh now."""
+        self.maps.requestRefresh()
+
+    def resolve(self, cookieStr):
+        """Returns the resolved cookie data, or None if it can't be decoded."""
+        try:
+            data = getCookieData(cookieStr)
+            _checkExperiments(data)
+        except ValueError as e:
+            log.debug("Failed to decode cookie '%s': %s", cookieStr, e)
+            return None
+        if not data:
+            return None
+        e, v = self.maps.get()
+        for i, d in (data.get("Experiments") or {}).items():
+            dv = str(d.get("v"))
+            if i not in e or (dv != EXCLUDED_VARIATION and dv not in (v.get(i) or {})):
+                self.maps.missing() # launched since the last refresh?
+                break
+        return resolveCookieData(data, e, v)
+
+    def health(self):
+        e, _ = self.maps.get() or ({}, {})
+        updated = self.maps.updated
+        return {
+            "account_id": self.account_id,
+            "project_id": self.project_id,
+            "experiences": len(e),
+            "updated": updated,
+            "age": time.time() - updated if updated else None,
+            "refreshes": self.maps.refreshes,
+            "failures": self.maps.failures,
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep connections open between lookups
+    disable_nagle_algorithm = True
+    resolver = None
+
+    def _send(self, status, body, contentType="application/json"):
+        b = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", contentType)
+        self.send_header("content-length", str(len(b)))
+        self.end_headers()
+        self.wfile.write(b)
+
+    def _error(self, status, message):
+        self._send(status, json.dumps({"isError": True, "code": status, "message": message}))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/resolve":
+            cookies = parse_qs(url.query).get("cookie")
+            if not cookies:
+                return self._error(400, "Missing 'cookie' parameter")
+            d = self.resolver.resolve(cookies[0])
+            if d is None:
+                return self._error(400, "Malformed cookie")
+            return self._send(200, json.dumps(d))
+        if url.path == "/health":
+            return self._send(200, json.dumps(self.resolver.health()))
+        self._error(404, "Not found")
+
+    def do_POST(self):
+        n = int(self.headers.get("content-length") or 0)
+        body = self.rfile.read(n).decode("utf-8") if n else ""
+        path = urlsplit(self.path).path
+        if path == "/resolve":
+            lines = [json.dumps(self.resolver.resolve(c.strip()))
+                     for c in body.splitlines() if c.strip()]
+            return self._send(200, "\n".join(lines) + "\n" if lines else "",
+                              contentType="application/x-ndjson")
+        if path == "/refresh":
+            self.resolver.requestRefresh()
+            return self._send(202, json.dumps({"refreshing": True}))
+        self._error(404, "Not found")
+
+    def address_string(self):
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        log.debug("%s - %s", self.address_string(), format % args)
+
+
+class _TCPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+def createServer(resolver, host="127.0.0.1", port=8765, socket_path=None):
+    """Returns an HTTP server (not yet serving) for a started
+    CookieResolver, on a Unix socket if socket_path is given. A stale
+    socket at socket_path is replaced; anything else there raises
+    ValueError."""
+    class Handler(_Handler):
+        pass
+    Handler.resolver = resolver
+
+    if socket_path:
+        Handler.disable_nagle_algorithm = False # not a TCP socket
+        if os.path.exists(socket_path):
+            if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+                raise ValueError("Not replacing '{}': it exists and isn't a socket".format(socket_path))
+            os.unlink(socket_path) # left over from an earlier run
+        return _UnixServer(socket_path, Handler)
+    return _TCPServer((host, port), Handler)
+
+
+def serve(account_id, project_id, host="127.0.0.1", port=8765, socket_path=None,
+          refresh_interval=300, **kwargs):
+    """Runs the daemon until interrupted. kwargs go to CookieResolver."""
+    resolver = CookieResolver(account_id, project_id, refresh_interval=refresh_interval, **kwargs).start()
+    try:
+        server = createServer(resolver, host=host, port=port, socket_path=socket_path)
+    except Exception:
+        resolver.stop()
+        raise
+    log.info("Resolving cookies for account/project {}/{} on {}".format(
+        account_id, project_id, socket_path or "http://{}:{}".format(*server.server_address[:2])))
+    def terminate(signum, frame):
+        raise KeyboardInterrupt()
+    signal.signal(signal.SIGTERM, terminate) # clean up on kill, too
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        resolver.stop()
+        if socket_path and os.path.exists(socket_path):
+            os.unlink(socket_path)
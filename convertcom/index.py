@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Integer-keyed index of a project's experiences, variations and goals
+
+getExperienceVariantMaps keys its maps by stringified IDs, so resolving a
+cookie costs a str() and two dict probes per experiment. An
+ExperienceIndex is built once from the experience listing and maps the
+integer IDs a cookie carries straight to compact records, with reverse
+lookups by key:
+
+    index = getExperienceIndex(account_id, project_id, application_id=..., secret=...)
+    for experience, variation in index.resolve(cookieStr):
+        ...
+    index.experienceByKey["experience-key"].id
+
+Segments aren't part of the experience listing; pass their records (dicts
+with 'id', 'key' and 'name') to build them into the index.
+"""
+
+import logging
+from collections import namedtuple
+
+from .api import ConvertAPIError, iterExperiences
+from .cookie import ConvertVisitorCookie, EXCLUDED_VARIATION
+
+
+log = logging.getLogger()
+
+ExperienceRecord = namedtuple("ExperienceRecord", "id key name status type traffic variations goals")
+VariationRecord = namedtuple("VariationRecord", "id key name status traffic experience_id")
+GoalRecord = namedtuple("GoalRecord", "id key name type")
+SegmentRecord = namedtuple("SegmentRecord", "id key name")
+
+# Variation record of an excluded visitor, as resolve() returns it
+EXCLUDED = VariationRecord(int(EXCLUDED_VARIATION), "*Excluded*", "Excluded", None, None, None)
+
+_INDEX_BODY_PARAMS = {
+    'include': ["variations", "goals"],
+    'expand': ["variations", "goals"]
+}
+
+
+class ExperienceIndex(object):
+    """Records of a project's experiences, variations, goals and segments.
+
+    `experiences`, `variations`, `goals` and `segments` map integer IDs to
+    ExperienceRecord, VariationRecord, GoalRecord and SegmentRecord
+    namedtuples. An experience record's `variations` and `goals` are tuples
+    of IDs. The reverse maps are `experienceByKey`, `goalByKey`,
+    `segmentByKey` and `variationByKey`, the latter keyed by
+    (experience ID, variation key), as variation keys repeat across
+    experiences.
+    """
+
+    def __init__(self, experiences=(), goals=(), segments=()):
+        self.experiences = {}
+        self.variations = {}
+        self.goals = {}
+        self.segments = {}
+        for g in goals:
+            self._addGoal(g)
+        for s in segments:
+            s = SegmentRecord(int(s['id']), s.get('key'), s.get('name'))
+            self.segments[s.id] = s
+        for e in experiences:
+            self._addExperience(e)
+
+        self.experienceByKey = {e.key: e for e in self.experiences.values()}
+        self.variationByKey = {(v.experience_id, v.key): v for v in self.variations.values()}
+        self.goalByKey = {g.key: g for g in self.goals.values() if g.key is not None}
+        self.segmentByKey = {s.key: s for s in self.segments.values() if s.key is not None}
+
+    def _addGoal(self, g):
+        if isinstance(g, dict):
+            g = GoalRecord(int(g['id']), g.get('key'), g.get('name'), g.get('type'))
+        else:
+            # not expanded: only the ID is known, unless given separately
+            g = self.goals.get(int(g)) or GoalRecord(int(g), None, None, None)
+        self.goals[g.id] = g
+        return g.id
+
+    def _addExperience(self, e):
+        i = int(e['id'])
+        variations = []
+        for v in e.get('variations') or ():
+            v = VariationRecord(int(v['id']), v['key'], v.get('name'), v.get('status'),
+                                v.get('traffic_distribution'), i)
+            self.variations[v.id] = v
+            variations.append(v.id)
+        goals = tuple(self._addGoal(g) for g in e.get('goals') or ())
+        self.experiences[i] = ExperienceRecord(i, e['key'], e.get('name'), e.get('status'), e.get('type'),
+                                               e.get('traffic_allocation'), tuple(variations), goals)
+
+    def __len__(self):
+        return len(self.experiences)
+
+    def __contains__(self, experience_id):
+        return experience_id in self.experiences
+
+    def __repr__(self):
+        return "ExperienceIndex({} experiences, {} variations, {} goals, {} segments)".format(
+            len(self.experiences), len(self.variations), len(self.goals), len(self.segments))
+
+    def experience(self, experience_id):
+        return self.experiences.get(experience_id)
+
+    def variation(self, variation_id):
+        return self.variations.get(variation_id)
+
+    def goal(self, goal_id):
+        return self.goals.get(goal_id)
+
+    def segment(self, segment_id):
+        return self.segments.get(segment_id)
+
+    def resolve(self, cookie):
+        """Returns a list of (ExperienceRecord, VariationRecord) pairs for
+        the experiments of a cookie (a ConvertVisitorCookie or raw _conv_v
+        string), in cookie order. The variation is EXCLUDED for an excluded
+        visitor; an ID missing from the index gives None in its place.
+        Raises ValueError for a malformed cookie.
+        """
+        if isinstance(cookie, str):
+            cookie = ConvertVisitorCookie(cookie)
+        return self.resolveVariations(cookie.experimentVariations())
+
+    def resolveVariations(self, pairs):
+        """resolve() for the {experiment id: variation id} dict of
+        ConvertVisitorCookie.experimentVariations()."""
+        experiences = self.experiences
+        variations = self.variations
+        excluded = EXCLUDED.id
+        out = []
+        for e, v in pairs.items():
+            er = experiences.get(e)
+            vr = variations.get(v)
+            if vr is None:
+                if v == excluded:
+                    vr = EXCLUDED
+            elif vr.experience_id != e:
+                vr = None
+            out.append((er, vr))
+        return out
+
+    def resolveKeys(self, cookie):
+        """Like resolve(), but returns {experience key: variation key}, with
+        None for a variation missing from the index. Unknown experiences are
+        left out."""
+        return {er.key: vr.key if vr is not None else None
+                for er, vr in self.resolve(cookie) if er is not None}
+
+    def variantMaps(self):
+        """Returns the (eMap, vMap) tuple getExperienceVariantMaps would."""
+        eMap = {}
+        vMap = {}
+        for e in self.experiences.values():
+            i = str(e.id)
+            eMap[i] = e.key
+            if e.variations:
+                vMap[i] = {str(v): self.variations[v].key for v in e.variations}
+        return (eMap, vMap)
+
+
+def getExperienceIndex(account_id, project_id, goals=(), segments=(), **kwargs):
+    """Builds an ExperienceIndex from the experiences of a project, with
+    expanded variations and goals. `goals` and `segments` may add records
+    from elsewhere. Returns False if the listing fails.
+    """
+    try:
+        return ExperienceIndex(iterExperiences(account_id, project_id, bodyParams=_INDEX_BODY_PARAMS, **kwargs),
+                               goals=goals, segments=segments)
+    except ConvertAPIError as e:
+        log.error(str(e))
+        return False
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Per-request metrics for API calls
+
+Register a hook to get a RequestMetrics record after every API request:
+
+    registry = convertcom.MetricsRegistry()
+    convertcom.addHook(registry)
+    ...
+    print(registry.quantile("total_time", convertcom.GET_EXPERIENCE_DAILY_REPORT_URL, 0.99))
+    print(json.dumps(registry.snapshot()))
+
+While no hook is registered, requests skip all timing and bookkeeping.
+
+Times are in seconds. `ttfb` is the time from sending the request until
+the response headers arrived (requests' Response.elapsed, or aiohttp's
+trace events). `connect_time` is only measured by AsyncConvertClient, and
+only for requests that had to open a new connection; it is None otherwise.
+"""
+
+import bisect
+import logging
+import threading
+
+
+log = logging.getLogger()
+
+# Registered hooks; the request path only checks whether this is empty.
+HOOKS = []
+
+
+def addHook(hook):
+    """Registers a callable that gets a RequestMetrics for every request."""
+    if hook not in HOOKS:
+        HOOKS.append(hook)
+
+
+def removeHook(hook):
+    if hook in HOOKS:
+        HOOKS.remove(hook)
+
+
+def emit(m):
+    for hook in list(HOOKS):
+        try:
+            hook(m)
+        except Exception:
+            log.exception("Metrics hook {} failed".format(hook))
+
+
+class RequestMetrics(object):
+    """Timings and sizes of one API request (including its retries)."""
+
+    __slots__ = ('endpoint', 'method', 'url', 'status', 'retries', 'error',
+                 'sign_time', 'connect_time', 'ttfb', 'total_time',
+                 'response_bytes', 'decode_time')
+
+    def __init__(self, endpoint, method, url, sign_time=None):
+        self.endpoint = endpoint # the URL template, e.g. LIST_EXPERIENCES_URL
+        self.method = method
+        self.url = url
+        self.status = None
+        self.retries = 0
+        self.error = None
+        self.sign_time = sign_time
+        self.connect_time = None
+        self.ttfb = None
+        self.total_time = None
+        self.response_bytes = None
+        self.decode_time = None
+
+    def to_dict(self):
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __repr__(self):
+        return "RequestMetrics({})".format(", ".join(
+            "{}={!r}".format(k, getattr(self, k)) for k in self.__slots__))
+
+
+# Histogram bucket upper bounds: seconds for timings, bytes for sizes
+TIME_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = tuple(2 ** i for i in range(8, 31, 2)) # 256B .. 1GB
+
+
+class Histogram(object):
+    """Fixed-bucket histogram. `counts` holds per-bucket (not cumulative)
+    counts, the last one for values above the highest bound;
+    MetricsRegistry.toPrometheus() adds them up into Prometheus' cumulative
+    buckets."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1) # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Estimates the q-quantile by linear interpolation within a bucket."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lo = self.buckets[i - 1] if i > 0 else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else lo
+                return lo + (hi - lo) * (rank - seen) / c
+            seen += c
+        return self.buckets[-1]
+
+    def to_dict(self):
+        return {
+            "buckets": list(self.buckets),
+            "counts": list(self.counts),
+            "count": self.count,
+            "sum": self.sum,
+        }
+
+
+class MetricsRegistry(object):
+    """Aggregates RequestMetrics into counters and histograms per endpoint.
+
+    An instance is itself a hook, to pass to addHook(). Thread-safe.
+    """
+
+    TIMINGS = ('sign_time', 'connect_time', 'ttfb', 'total_time', 'decode_time')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {} # (name, endpoint, status) -> int
+            self.histograms = {} # (name, endpoint) -> Histogram
+
+    def _histogram(self, name, endpoint):
+        h = self.histograms.get((name, endpoint))
+        if h is None:
+            h = self.histograms[(name, endpoint)] = Histogram(
+                SIZE_BUCKETS if name == 'response_bytes' else TIME_BUCKETS)
+        return h
+
+    def _count(self, name, endpoint, status=None, value=1):
+        key = (name, endpoint, status)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def __call__(self, m):
+        with self._lock:
+            self._count('requests', m.endpoint, m.status)
+            if m.retries:
+                self._count('retries', m.endpoint, value=m.retries)
+            if m.error is not None:
+                self._count('errors', m.endpoint)
+            if m.response_bytes is not None:
+                self._count('response_bytes', m.endpoint, value=m.response_bytes)
+                self._histogram('response_bytes', m.endpoint).observe(m.response_bytes)
+            for name in self.TIMINGS:
+                v = getattr(m, name)
+                if v is not None:
+                    self._histogram(name, m.endpoint).observe(v)
+
+    def quantile(self, name, endpoint, q):
+        with self._lock:
+            h = self.histograms.get((name, endpoint))
+            return h.quantile(q) if h is not None else None
+
+    def snapshot(self):
+        """Returns the counters and histograms as JSON-serializable data."""
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": n, "endpoint": e, "status": s, "value": v}
+                    for (n, e, s), v in sorted(self.counters.items(), key=str)],
+                "histograms": [
+                    dict(h.to_dict(), name=n, endpoint=e,
+                         p50=h.quantile(0.5), p90=h.quantile(0.9), p99=h.quantile(0.99))
+                    for (n, e), h in sorted(self.histograms.items(), key=str)],
+            }
+
+    def toPrometheus(self, prefix="convertcom"):
+        """Returns the metrics in the Prometheus text exposition format."""
+        def labels(**kw):
+            return ",".join('{}="{}"'.format(k, v) for k, v in kw.items() if v is not None)
+
+        lines = []
+        with self._lock:
+            for (n, e, s), v in sorted(self.counters.items(), key=str):
+                lines.append("{}_{}_total{{{}}} {}".format(prefix, n, labels(endpoint=e, status=s), v))
+            for (n, e), h in sorted(self.histograms.items(), key=str):
+                cumulative = 0
+                for bound, c in zip(list(h.buckets) + ["+Inf"], h.counts):
+                    cumulative += c
+                    lines.append("{}_{}_bucket{{{}}} {}".format(
+                        prefix, n, labels(endpoint=e, le=bound), cumulative))
+                lines.append("{}_{}_sum{{{}}} {}".format(prefix, n, labels(endpoint=e), h.sum))
+                lines.append("{}_{}_count{{{}}} {}".format(prefix, n, labels(endpoint=e), h.count))
+        return "\n".join(lines) + "\n"
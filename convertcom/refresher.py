@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Stale-while-revalidate snapshots of the experience/variation maps
+
+Building the maps takes a full expanded experience listing, which can take
+seconds. A VariantMapRefresher serves the current snapshot immediately and
+rebuilds it in a background thread, every `interval` seconds and whenever
+a lookup misses an experience or variation ID it doesn't know (e.g. one
+launched since the last refresh). The new snapshot is swapped in as a
+whole, so readers see either the old or the new maps, never a mix, and
+never wait for the network:
+
+    maps = VariantMapRefresher(account_id, project_id, application_id=..., secret=...).start()
+    maps.variationKey(experience_id, variation_id)
+
+AsyncVariantMapRefresher does the same with an asyncio task, on top of an
+AsyncConvertClient.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+
+from .api import ConvertAPIError, iterExperiences, _buildExperienceVariantMaps, _VARIANT_MAPS_BODY_PARAMS
+
+
+log = logging.getLogger()
+
+
+class _Snapshot(object):
+    """Lookup helpers shared by both refreshers; subclasses keep the
+    (eMap, vMap) tuple in self._maps and implement requestRefresh()."""
+
+    def get(self):
+        """Returns the current (eMap, vMap) snapshot, or None before the
+        first successful refresh."""
+        return self._maps
+
+    def _requestRefreshOnMiss(self):
+        now = time.monotonic()
+        if now - self._lastMissRefresh >= self.miss_interval:
+            self._lastMissRefresh = now
+            self.requestRefresh()
+
+    def experienceKey(self, experience_id):
+        """Returns an experience's key, or None if it isn't (yet) known; an
+        unknown ID triggers a background refresh (at most once every
+        miss_interval seconds)."""
+        maps = self._maps
+        k = maps[0].get(str(experience_id)) if maps else None
+        if k is None:
+            self._requestRefreshOnMiss()
+        return k
+
+    def variationKey(self, experience_id, variation_id):
+        """Returns a variation's key, or None if it isn't (yet) known, like
+        experienceKey()."""
+        maps = self._maps
+        k = (maps[1].get(str(experience_id)) or {}).get(str(variation_id)) if maps else None
+        if k is None:
+            self._requestRefreshOnMiss()
+        return k
+
+    def missing(self):
+        """Tells the refresher a lookup done on get()'s maps missed."""
+        self._requestRefreshOnMiss()
+
+
+class VariantMapRefresher(_Snapshot):
+    """Keeps a getExperienceVariantMaps snapshot of one project fresh from
+    a background thread.
+
+    Refreshes every `interval` seconds, `retry_interval` seconds after a
+    failed refresh, and on lookup misses, but no more than once every
+    `miss_interval` seconds for those. kwargs go to
+    iterExperiences (application_id, secret, session, ...); a 'cache' kwarg
+    is ignored, as refreshes must reach the API.
+    """
+
+    def __init__(self, account_id, project_id, interval=300, retry_interval=30, miss_interval=30,
+                 **kwargs):
+        self.account_id = account_id
+        self.project_id = project_id
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.miss_interval = miss_interval
+        kwargs.pop('cache', None)
+        self._kwargs = kwargs
+
+        self._maps = None
+        self.updated = None # time.time() of the last successful refresh
+        self.refreshes = 0
+        self.failures = 0
+        self._lastMissRefresh = float("-inf")
+        self._loaded = threading.Event()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Rebuilds the maps in the calling thread and swaps them in.
+        Returns whether that succeeded; on failure the old maps are kept."""
+        try:
+            # built straight from the listing: a refresh must not be served from a cache
+            e, v = _buildExperienceVariantMaps(iterExperiences(
+                self.account_id, self.project_id, bodyParams=_VARIANT_MAPS_BODY_PARAMS, **self._kwargs))
+        except ConvertAPIError as err:
+            log.error(str(err))
+            e = v = False
+        except Exception:
+            log.exception("Refreshing the experience/variant map failed")
+            e = v = False
+        if e is False: # an empty project gives ({}, {}), which is fine
+            self.failures += 1
+            log.error("Failed to refresh experience/variant map in account/project {accountId}/{projectId}!".format(
+                accountId=self.account_id, projectId=self.project_id))
+            return False
+
+        self._maps = (e, v) # readers pick up the new tuple as a whole
+        self.updated = time.time()
+        self.refreshes += 1
+        self._loaded.set()
+        return True
+
+    def start(self, wait=True, timeout=None):
+        """Starts the background thread, which loads the maps right away
+        unless refresh() already did. With `wait`, returns once they're
+        loaded (or `timeout` passes)."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="VariantMapRefresher", daemon=True)
+            self._thread.start()
+        if wait:
+            self._loaded.wait(timeout)
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread = None
+
+    def requestRefresh(self):
+        """Makes the background thread refresh now (without waiting for it)."""
+        self._wake.set()
+
+    def _run(self):
+        ok = self._maps is not None or self.refresh() # no need to load twice
+        while not self._stop.is_set():
+            self._wake.wait(self.interval if ok else min(self.interval, self.retry_interval))
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            ok = self.refresh()
+
+
+class AsyncVariantMapRefresher(_Snapshot):
+    """VariantMapRefresher for asyncio: refreshes from a task running on
+    the event loop, through an AsyncConvertClient."""
+
+    def __init__(self, client, account_id, project_id, interval=300, retry_interval=30,
+                 miss_interval=30, **kwargs):
+        self.client = client
+        self.account_id = account_id
+        self.project_id = project_id
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.miss_interval = miss_interval
+        self._kwargs = kwargs
+
+        self._maps = None
+        self.updated = None
+        self.refreshes = 0
+        self.failures = 0
+        self._lastMissRefresh = float("-inf")
+        self._loaded = None # asyncio objects are created on the running loop
+        self._wake = None
+        self._task = None
+
+    async def refresh(self):
+        try:
+            d = []
+            async for x in self.client.iterExperiences(self.account_id, self.project_id,
+                                                       bodyParams=_VARIANT_MAPS_BODY_PARAMS, **self._kwargs):
+                d.append(x)
+            e, v = _buildExperienceVariantMaps(d)
+        except ConvertAPIError as err:
+            log.error(str(err))
+            e = v = False
+        except Exception:
+            log.exception("Refreshing the experience/variant map failed")
+            e = v = False
+        if e is False:
+            self.failures += 1
+            log.error("Failed to refresh experience/variant map in account/project {accountId}/{projectId}!".format(
+                accountId=self.account_id, projectId=self.project_id))
+            return False
+
+        self._maps = (e, v)
+        self.updated = time.time()
+        self.refreshes += 1
+        if self._loaded is not None:
+            self._loaded.set()
+        return True
+
+    async def start(self, wait=True, timeout=None):
+        if self._task is None:
+            self._loaded = asyncio.Event()
+            self._wake = asyncio.Event()
+            self._task = asyncio.ensure_future(self._run())
+        if wait:
+            try:
+                await asyncio.wait_for(self._loaded.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def requestRefresh(self):
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _run(self):
+        ok = self._maps is not None or await self.refresh()
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(),
+                                       self.interval if ok else min(self.interval, self.retry_interval))
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            ok = await self.refresh()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Retries and rate limiting for API requests
+
+Every request made through doRequest (and AsyncConvertClient) first takes a
+token from a TokenBucket (RATE_LIMITER unless a 'rate_limiter' kwarg is
+given) and is retried according to a RetryPolicy (DEFAULT_RETRY_POLICY
+unless a 'retry' kwarg is given).
+
+RATE_LIMITER is shared by every call in the process and is unlimited until
+configured, e.g.:
+
+    convertcom.setRateLimit(10, burst=20) # 10 requests/second
+
+A 429 response with a Retry-After header pauses the shared bucket, so all
+other callers back off too instead of running into the limit themselves.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+
+log = logging.getLogger()
+
+
+class RetryPolicy(object):
+    """Exponential backoff with full jitter.
+
+    A request is retried up to `max_retries` times on connection errors and
+    on the `statuses` response codes. Before retry n (counting from 0) it
+    waits a random time of up to backoff * 2**n seconds, capped at
+    max_backoff, or for the response's Retry-After if that is longer. A
+    Retry-After beyond max_retry_after (default: max_backoff) isn't waited
+    out: the request fails instead.
+    """
+
+    def __init__(self, max_retries=3, backoff=0.5, max_backoff=30, jitter=True,
+                 statuses=(429, 500, 502, 503, 504), max_retry_after=None):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_backoff if max_retry_after is None else max_retry_after
+        self.jitter = jitter
+        self.statuses = frozenset(statuses)
+
+    def shouldRetry(self, attempt, status_code=None, retryAfter=None):
+        """Whether to retry after `attempt` failed attempts (counting from 0)
+        ended with `status_code` (None for a connection error) and a
+        Retry-After of `retryAfter` seconds."""
+        if attempt >= self.max_retries:
+            return False
+        if status_code is not None and status_code not in self.statuses:
+            return False
+        if retryAfter is not None and retryAfter > self.max_retry_after:
+            log.warning("Not retrying: Retry-After of {:.0f}s exceeds the {:.0f}s limit".format(
+                retryAfter, self.max_retry_after))
+            return False
+        return True
+
+    def delay(self, attempt, retryAfter=None):
+        d = min(self.max_backoff, self.backoff * (2 ** attempt))
+        if self.jitter:
+            d = random.uniform(0, d)
+        if retryAfter is not None:
+            d = max(d, min(retryAfter, self.max_retry_after))
+        return d
+
+
+def parseRetryAfter(value):
+    """Returns a Retry-After header value in seconds, or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket(object):
+    """Token-bucket rate limiter, safe to share between threads and asyncio
+    tasks.
+
+    Allows `rate` requests per second on average and bursts of up to `burst`
+    requests (default: rate). With rate None it never limits, but pause()
+    still holds everyone back.
+
+    Callers reserve a token under a lock and then wait outside of it, with
+    time.sleep from acquire() or asyncio.sleep from acquireAsync().
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self._lock = threading.Lock()
+        self._pausedUntil = 0.0
+        self.configure(rate, burst)
+
+    def configure(self, rate=None, burst=None):
+        with self._lock:
+            self.rate = rate
+            self.burst = burst or rate or 1
+            self._tokens = float(self.burst)
+            self._updated = time.monotonic()
+
+    def reserve(self):
+        """Takes a token and returns how many seconds to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._pausedUntil - now)
+            if self.rate:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                self._tokens -= 1
+                if self._tokens < 0:
+                    wait = max(wait, -self._tokens / self.rate)
+            return wait
+
+    def pause(self, seconds):
+        """Holds back every caller for the next `seconds` seconds."""
+        with self._lock:
+            self._pausedUntil = max(self._pausedUntil, time.monotonic() + seconds)
+
+    def acquire(self):
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquireAsync(self):
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
+RATE_LIMITER = TokenBucket()
+
+def setRateLimit(rate, burst=None):
+    """Configures the limiter shared by all API calls (None: unlimited)."""
+    RATE_LIMITER.configure(rate, burst)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Account-wide inventory snapshots
+
+snapshotAccount lists every project of an account, then lists the
+experiences (with expanded variations) of all of them concurrently, over
+one HTTP session, so an inventory takes about as long as the largest
+project rather than the sum of all of them. The result is plain JSON:
+
+    snap = snapshotAccount(account_id, application_id=..., secret=...)
+    json.dump(snap, open("inventory.json", "w"))
+    changes = diffSnapshots(json.load(open("previous.json")), snap)
+
+Project and experience IDs are string keys, as they are once the
+snapshot has been through JSON.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .api import ConvertAPIError, iterProjects, iterExperiences
+
+
+log = logging.getLogger()
+
+_SNAPSHOT_BODY_PARAMS = {
+    'include': ["variations"],
+    'expand': ["variations"]
+}
+
+# Fields that change without the experience itself changing
+IGNORED_FIELDS = ("stats",)
+
+
+def snapshotAccount(account_id, project_ids=None, max_workers=8, **kwargs):
+    """Returns a snapshot of the projects of an account and their
+    experiences:
+
+        {"account_id": ..., "taken_at": <unix time>,
+         "projects": {project id: {"project": {...}, "experiences": {experience id: {...}}}},
+         "errors": {project id: message}}
+
+    `project_ids` limits the snapshot to those projects (the project
+    listing is then skipped). Up to max_workers projects are listed
+    concurrently over one session (the 'session' kwarg, or a new one). A
+    project whose experiences can't be listed is left out of 'projects'
+    and reported in 'errors'. Returns False if the projects can't be
+    listed.
+    """
+    from .client import createSession
+
+    session = kwargs.pop('session', None)
+    ownsSession = session is None
+    if ownsSession:
+        session = createSession(pool_maxsize=max_workers)
+
+    def snapshotProject(project):
+        experiences = {}
+        for e in iterExperiences(account_id, project["id"], bodyParams=_SNAPSHOT_BODY_PARAMS,
+                                 session=session, **kwargs):
+            experiences[str(e["id"])] = e
+        return experiences
+
+    takenAt = time.time()
+    try:
+        if project_ids is None:
+            try:
+                projects = list(iterProjects(account_id, session=session, **kwargs))
+            except ConvertAPIError as e:
+                log.error(str(e))
+                return False
+        else:
+            projects = [{"id": p} for p in project_ids]
+
+        snap = {"account_id": account_id, "taken_at": takenAt, "projects": {}, "errors": {}}
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = [(p, pool.submit(snapshotProject, p)) for p in projects]
+            for p, f in futures:
+                pid = str(p["id"])
+                try:
+                    snap["projects"][pid] = {"project": p, "experiences": f.result()}
+                except Exception as e:
+                    log.error("Failed to snapshot account/project {accountId}/{projectId}: {e}".format(
+                        accountId=account_id, projectId=pid, e=e))
+                    snap["errors"][pid] = str(e)
+        return snap
+    finally:
+        if ownsSession:
+            session.close()
+
+
+def _changedFields(old, new):
+    """Returns {field: [old value, new value]} for the top-level fields
+    that differ between two dicts."""
+    changes = {}
+    for k in old.keys() | new.keys():
+        if k in IGNORED_FIELDS:
+            continue
+        if old.get(k) != new.get(k):
+            changes[k] = [old.get(k), new.get(k)]
+    return changes
+
+
+def diffSnapshots(old, new):
+    """Compares two snapshotAccount results (e.g. one loaded from JSON and
+    a fresh one). Returns:
+
+        {"projects": {"added": [ids], "removed": [ids], "changed": {id: {field: [old, new]}}},
+         "experiences": {"added": [{"project_id", "experience_id", "key", "name"}],
+                         "removed": [...same...],
+                         "changed": [{"project_id", "experience_id", "key", "changes": {field: [old, new]}}]},
+         "skipped": [project ids that failed in either snapshot]}
+
+    Projects that failed in either snapshot are skipped rather than
+    reported as removed or emptied.
+    """
+    oldProjects = old.get("projects") or {}
+    newProjects = new.get("projects") or {}
+    skipped = set(old.get("errors") or ()) | set(new.get("errors") or ())
+
+    diff = {
+        "from": old.get("taken_at"),
+        "to": new.get("taken_at"),
+        "projects": {"added": [], "removed": [], "changed": {}},
+        "experiences": {"added": [], "removed": [], "changed": []},
+        "skipped": sorted(skipped),
+    }
+
+    def summary(pid, eid, e):
+        return {"project_id": pid, "experience_id": eid, "key": e.get("key"), "name": e.get("name")}
+
+    for pid in sorted(oldProjects.keys() | newProjects.keys()):
+        if pid in skipped:
+            continue
+        o = oldProjects.get(pid)
+        n = newProjects.get(pid)
+        if o is None:
+            diff["projects"]["added"].append(pid)
+        elif n is None:
+            diff["projects"]["removed"].append(pid)
+        else:
+            changes = _changedFields(o["project"], n["project"])
+            if changes:
+                diff["projects"]["changed"][pid] = changes
+
+        oe = (o or {}).get("experiences") or {}
+        ne = (n or {}).get("experiences") or {}
+        for eid in sorted(oe.keys() | ne.keys()):
+            if eid not in oe:
+                diff["experiences"]["added"].append(summary(pid, eid, ne[eid]))
+            elif eid not in ne:
+                diff["experiences"]["removed"].append(summary(pid, eid, oe[eid]))
+            else:
+                changes = _changedFields(oe[eid], ne[eid])
+                if changes:
+                    diff["experiences"]["changed"].append({
+                        "project_id": pid, "experience_id": eid, "key": ne[eid].get("key"),
+                        "changes": changes})
+    return diff
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Local significance statistics for experiences
+
+Instead of one getExperienceStats call per experience, compute conversion
+rates, lift, confidence intervals and p-values from the visitor and
+conversion counts in the reports, for every variation against the
+baseline and for any number of experiences at once:
+
+    columns = [reportColumns(r) for r in reports]     # see columnar.py
+    ids, visitors, conversions = stackColumns(columns)
+    s = compareVariations(visitors, conversions)      # (experiences, variations) arrays
+    ranked = rankExperiences(experience_ids, columns)
+
+Frequentist results come from a two-sided two-proportion z-test (pooled
+standard error) with Wald intervals for the difference in rates. The
+Bayesian probability to beat the baseline uses Beta posteriors, compared
+through a normal approximation, which is close to exact at the sample
+sizes A/B tests run at. Everything is NumPy array arithmetic; requires
+numpy.
+"""
+
+import logging
+import math
+from statistics import NormalDist
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+log = logging.getLogger()
+
+
+def _requireNumpy():
+    if np is None:
+        raise ImportError("convertcom.stats requires the 'numpy' package")
+
+
+def erfc(x):
+    """Complementary error function of an array, with a relative error below
+    1.2e-7 (Chebyshev fit from Numerical Recipes), as numpy has none."""
+    x = np.asarray(x, dtype=float)
+    z = np.abs(x)
+    t = 1.0 / (1.0 + 0.5 * z)
+    r = t * np.exp(-z * z - 1.26551223 + t * (1.00002368 + t * (0.37409196 + t * (0.09678418 +
+        t * (-0.18628806 + t * (0.27886807 + t * (-1.13520398 + t * (1.48851587 +
+        t * (-0.82215223 + t * 0.17087277)))))))))
+    return np.where(x >= 0, r, 2.0 - r)
+
+
+def normalCdf(x):
+    return 0.5 * erfc(-np.asarray(x, dtype=float) / math.sqrt(2))
+
+
+def normalSf(x):
+    """1 - normalCdf(x), without the cancellation in the upper tail."""
+    return 0.5 * erfc(np.asarray(x, dtype=float) / math.sqrt(2))
+
+
+def _baselineOf(a, baseline):
+    if np.ndim(baseline) == 0:
+        return a[..., baseline:baseline + 1]
+    return np.take_along_axis(a, np.asarray(baseline)[..., None], axis=-1)
+
+
+def compareVariations(visitors, conversions, baseline=0, confidence=0.95, prior=(1, 1)):
+    """Compares each variation with the baseline.
+
+    `visitors` and `conversions` are arrays of shape (..., variations),
+    e.g. (experiences, variations); NaN entries (padding) give NaN results.
+    `baseline` is the baseline's index along the last axis, or an array of
+    indices per experience. `prior` is the (alpha, beta) of the Beta prior
+    on each conversion rate.
+
+    Returns a dict of arrays shaped like the inputs: rate, diff (rate minus
+    the baseline's rate), lift (diff relative to the baseline's rate),
+    diff_low/diff_high and lift_low/lift_high (confidence interval), z,
+    p_value, significant (p_value < 1 - confidence), prob_beat_baseline
+    (Bayesian) and is_baseline.
+    """
+    _requireNumpy()
+    n = np.asarray(visitors, dtype=float)
+    c = np.asarray(conversions, dtype=float)
+    nb = _baselineOf(n, baseline)
+    cb = _baselineOf(c, baseline)
+    zCrit = NormalDist().inv_cdf(0.5 + confidence / 2.0)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = c / n
+        rateb = cb / nb
+        diff = rate - rateb
+        lift = diff / rateb
+
+        pooled = (c + cb) / (n + nb)
+        z = diff / np.sqrt(pooled * (1 - pooled) * (1 / n + 1 / nb))
+        pValue = np.minimum(1.0, 2 * normalSf(np.abs(z)))
+
+        se = np.sqrt(rate * (1 - rate) / n + rateb * (1 - rateb) / nb)
+        diffLow = diff - zCrit * se
+        diffHigh = diff + zCrit * se
+
+        a, b = prior[0] + c, prior[1] + n - c
+        ab, bb = prior[0] + cb, prior[1] + nb - cb
+        mean, meanb = a / (a + b), ab / (ab + bb)
+        var = a * b / ((a + b) ** 2 * (a + b + 1))
+        varb = ab * bb / ((ab + bb) ** 2 * (ab + bb + 1))
+        prob = np.clip(normalCdf((mean - meanb) / np.sqrt(var + varb)), 0.0, 1.0)
+
+        results = {
+            "rate": rate,
+            "diff": diff,
+            "lift": lift,
+            "diff_low": diffLow,
+            "diff_high": diffHigh,
+            "lift_low": diffLow / rateb,
+            "lift_high": diffHigh / rateb,
+            "z": z,
+            "p_value": pValue,
+            "significant": pValue < (1 - confidence),
+            "prob_beat_baseline": np.where(np.isnan(n) | np.isnan(nb), np.nan, prob),
+        }
+
+    isBaseline = np.zeros(n.shape, dtype=bool)
+    if np.ndim(baseline) == 0:
+        isBaseline[..., baseline] = True
+    else:
+        np.put_along_axis(isBaseline, np.asarray(baseline)[..., None], True, axis=-1)
+    results["is_baseline"] = isBaseline
+    return results
+
+
+def stackColumns(columns, visitors="visitors", conversions="conversions"):
+    """Stacks the per-variation totals of several ReportColumns into
+    (experiences, variations) arrays, padded with NaN (and variation ID -1)
+    where an experience has fewer variations. Returns (variation_ids,
+    visitors, conversions).
+
+    Note that for a daily report the total of a per-day visitors metric
+    counts a visitor once per day they were seen.
+    """
+    _requireNumpy()
+    width = max([len(col.variation_ids) for col in columns] or [0])
+    ids = np.full((len(columns), width), -1, dtype=np.int64)
+    n = np.full((len(columns), width), np.nan)
+    c = np.full((len(columns), width), np.nan)
+    for i, col in enumerate(columns):
+        k = len(col.variation_ids)
+        ids[i, :k] = col.variation_ids
+        n[i, :k] = col.totals(visitors)
+        c[i, :k] = col.totals(conversions)
+    return ids, n, c
+
+
+def rankExperiences(experience_ids, columns, by="prob_beat_baseline", baseline=0,
+                    confidence=0.95, visitors="visitors", conversions="conversions"):
+    """Finds the best non-baseline variation of each experience (highest
+    `by`, one of compareVariations' results) and returns one dict per
+    experience, best first, with its experience_id, variation_id, rate,
+    lift, lift_low, lift_high, p_value, significant and prob_beat_baseline.
+    """
+    _requireNumpy()
+    ids, n, c = stackColumns(columns, visitors, conversions)
+    s = compareVariations(n, c, baseline=baseline, confidence=confidence)
+
+    score = np.where(s["is_baseline"] | np.isnan(s[by]), -np.inf, s[by])
+    best = np.argmax(score, axis=1)
+    rows = np.arange(len(best))
+    order = np.argsort(-score[rows, best], kind="stable")
+
+    ranked = []
+    for i in order:
+        j = best[i]
+        if score[i, j] == -np.inf:
+            continue # no variation to compare
+        r = {"experience_id": experience_ids[i], "variation_id": int(ids[i, j])}
+        for k in ("rate", "lift", "lift_low", "lift_high", "p_value", "prob_beat_baseline"):
+            r[k] = float(s[k][i, j])
+        r["significant"] = bool(s["significant"][i, j])
+        ranked.append(r)
+    return ranked
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Incremental decoding of large report responses
+
+getExperienceDailyReport holds the raw response, the decoded tree and (at
+verbose > 1) a pretty-printed copy in memory at once. The stream* functions
+here instead decode the response as it arrives and yield one record at a
+time, holding at most one variation's data plus one read chunk:
+
+    for day in streamExperienceDailyReport(account_id, project_id, experience_id, ...):
+        ...
+
+Only the array being walked is decoded item by item; the JSON in front of
+it is skipped value by value, and everything after it is never read.
+"""
+
+import codecs
+import json
+import logging
+
+from .api import (
+    doRequest,
+    _getExperienceDailyReportRequest,
+    _getExperienceAggregatedReportRequest,
+    ConvertAPIError,
+)
+
+
+log = logging.getLogger()
+
+# Where the per-variation data sits in a report response
+REPORT_VARIATIONS_PATH = ("data", "reportData", "variations")
+
+_WHITESPACE = " \t\n\r"
+# Characters that can't follow a complete JSON value, but can continue a number
+_NUMBER_CHARS = "0123456789.eE+-"
+
+
+class _JsonReader(object):
+    """Pull parser over an iterable of text chunks.
+
+    Values are decoded with json.JSONDecoder.raw_decode (i.e. in C); when a
+    value runs past the end of the buffer, more chunks are read and the
+    value is decoded again.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _fill(self, grow=False):
+        """Reads another chunk into the buffer; with `grow`, reads until the
+        unconsumed part of the buffer has doubled, so that re-decoding a
+        large value stays linear overall. Returns False at the end of data.
+        """
+        if self._eof:
+            return False
+        if self._pos > len(self._buf) // 2:
+            # drop what has been consumed already
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+
+        want = 2 * (len(self._buf) - self._pos) if grow else 0
+        chunks = [self._buf]
+        size = len(self._buf) - self._pos
+        while True:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._eof = True
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= want:
+                break
+        self._buf = "".join(chunks)
+        return len(chunks) > 1
+
+    def peek(self):
+        """Returns the next non-whitespace character without consuming it."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON data")
+
+    def expect(self, chars):
+        c = self.peek()
+        if c not in chars:
+            raise ValueError("Expected one of '{}' at offset {}, found '{}'".format(chars, self._pos, c))
+        self._pos += 1
+        return c
+
+    def value(self):
+        """Decodes and consumes the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                v, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill(grow=True):
+                    raise
+                continue
+            if (end == len(self._buf) or self._buf[end] in _NUMBER_CHARS) and self._fill():
+                continue # a number that may continue in the next chunk
+            self._pos = end
+            return v
+
+
+def iterJsonArray(chunks, path):
+    """Yields the items of the JSON array found at `path` (a sequence of
+    object keys) in a document given as an iterable of text chunks. Yields
+    nothing if the path isn't in the document.
+    """
+    reader = _JsonReader(chunks)
+    for key in path:
+        if reader.peek() != "{":
+            return
+        reader.expect("{")
+        if reader.peek() == "}":
+            return
+        while True:
+            k = reader.value()
+            reader.expect(":")
+            if k == key:
+                break
+            reader.value() # skip
+            if reader.expect(",}") == "}":
+                return
+
+    if reader.peek() != "[":
+        return
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+    while True:
+        yield reader.value()
+        if reader.expect(",]") == "]":
+            return
+
+
+def _textChunks(r, chunk_size):
+    decoder = codecs.getincrementaldecoder(r.encoding or "utf-8")()
+    for chunk in r.iter_content(chunk_size=chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def _streamVariations(prepared, chunk_size=65536):
+    u, method, headers, opts = prepared
+    opts["stream"] = True
+    r = doRequest(u, method, headers, **opts)
+    if not r:
+        raise ConvertAPIError("Failed to fetch report from '{}'!".format(u))
+
+    with r:
+        for v in iterJsonArray(_textChunks(r, chunk_size), REPORT_VARIATIONS_PATH):
+            yield v
+
+
+def streamExperienceDailyReport(account_id, project_id, experience_id, **kwargs):
+    """Yields the daily report of an experience one record per variation and
+    day, as the response is decoded. Each record is a day entry of the
+    variation's 'stats' with the variation's id added as 'variation_id'.
+    Raises ConvertAPIError if the report can't be fetched.
+    """
+    for v in _streamVariations(_getExperienceDailyReportRequest(
+            account_id, project_id, experience_id, **kwargs)):
+        variationId = v.get("id")
+        for day in v.get("stats") or []:
+            record = dict(day) if isinstance(day, dict) else {"value": day}
+            record["variation_id"] = variationId
+            yield record
+
+
+def streamExperienceAggregatedReport(account_id, project_id, experience_id, **kwargs):
+    """Yields the aggregated report of an experience one variation at a
+    time, as the response is decoded. Raises ConvertAPIError if the report
+    can't be fetched.
+    """
+    for v in _streamVariations(_getExperienceAggregatedReportRequest(
+            account_id, project_id, experience_id, **kwargs)):
+        yield v
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+#
+# Copyright 2024 CampaignTrip
+# Copyright 2024 David Goodman
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Incremental sync of daily reports into a local SQLite store
+
+getExperienceDailyReport returns an experience's whole history on every
+call. syncDailyReports instead keeps the per-variation daily rows in a
+DailyReportStore and, once an experience has been synced, only requests
+the days from the last synced day minus `recheck_days` onwards (days
+close to "today" may still change), merging them over the stored rows:
+
+    store = DailyReportStore("reports.db")
+    syncDailyReports(account_id, project_id, experience_ids, store,
+                     application_id=..., secret=...)
+    rows = store.rows(account_id, project_id, experience_id)
+
+The range is sent as start_time/end_time (unix timestamps) in the request
+body; rows before the range are dropped even if the API returns them, so
+a sync is correct either way.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from calendar import timegm
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from .stream import streamExperienceDailyReport
+
+
+log = logging.getLogger()
+
+# Day field of a daily report row: an ISO date(time) string or unix timestamp
+DAY_FIELD = "date"
+
+
+def _dayOf(record):
+    """Returns a daily report row's day as 'YYYY-MM-DD', or None."""
+    v = record.get(DAY_FIELD)
+    if isinstance(v, (int, float)):
+        return time.strftime("%Y-%m-%d", time.gmtime(v))
+    if isinstance(v, str) and len(v) >= 10:
+        return v[:10]
+    return None
+
+
+class DailyReportStore(object):
+    """SQLite store of per-variation daily report rows.
+
+    Rows are keyed by account, project, experience, variation and day, and
+    merged with INSERT OR REPLACE inside one transaction per experience, so
+    readers (in any process) see either the previous or the new sync. Runs
+    in WAL mode; safe to use from several threads and processes.
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = path
+        self.timeout = timeout
+
+        self._local = threading.local()
+        with self._connect() as db:
+            db.execute("""CREATE TABLE IF NOT EXISTS daily_rows (
+                account_id TEXT NOT NULL,
+                project_id TEXT NOT NULL,
+                experience_id TEXT NOT NULL,
+                variation_id TEXT NOT NULL,
+                day TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (account_id, project_id, experience_id, variation_id, day)
+            )""")
+            db.execute("""CREATE TABLE IF NOT EXISTS sync_state (
+                account_id TEXT NOT NULL,
+                project_id TEXT NOT NULL,
+                experience_id TEXT NOT NULL,
+                last_day TEXT,
+                synced_at REAL NOT NULL,
+                PRIMARY KEY (account_id, project_id, experience_id)
+            )""")
+
+    def _connect(self):
+        # one connection per thread, reopened after a fork (as in SQLiteCache)
+        db = getattr(self._local, "db", None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=self.timeout)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def lastDay(self, account_id, project_id, experience_id):
+        """Returns the last synced day ('YYYY-MM-DD') of an experience, or
+        None if it has never been synced."""
+        row = self._connect().execute(
+            "SELECT last_day FROM sync_state WHERE account_id=? AND project_id=? AND experience_id=?",
+            (str(account_id), str(project_id), str(experience_id))).fetchone()
+        return row[0] if row is not None else None
+
+    def merge(self, account_id, project_id, experience_id, rows):
+        """Stores (variation_id, day, record) rows over any existing ones
+        for the same variation and day, and records the sync. Returns the
+        number of rows written."""
+        key = (str(account_id), str(project_id), str(experience_id))
+        count = 0
+        lastDay = None
+        with self._connect() as db:
+            for variationId, day, record in rows:
+                db.execute("INSERT OR REPLACE INTO daily_rows VALUES (?, ?, ?, ?, ?, ?)",
+                           key + (str(variationId), day, json.dumps(record)))
+                count += 1
+                if lastDay is None or day > lastDay:
+                    lastDay = day
+            db.execute("""INSERT INTO sync_state VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (account_id, project_id, experience_id) DO UPDATE SET
+                last_day=CASE WHEN excluded.last_day > coalesce(last_day, '')
+                    THEN excluded.last_day ELSE last_day END,
+                synced_at=excluded.synced_at""", key + (lastDay, time.time()))
+        return count
+
+    def rows(self, account_id, project_id, experience_id, since=None):
+        """Returns the stored rows of an experience (from day `since` on, if
+        given) as report records with 'variation_id' set, ordered by day."""
+        sql = """SELECT data FROM daily_rows WHERE account_id=? AND project_id=? AND experience_id=?"""
+        args = [str(account_id), str(project_id), str(experience_id)]
+        if since is not None:
+            sql += " AND day >= ?"
+            args.append(since)
+        sql += " ORDER BY day, variation_id"
+        return [json.loads(r[0]) for r in self._connect().execute(sql, args)]
+
+    def close(self):
+        db = getattr(self._local, "db", None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+
+def _syncExperience(store, account_id, project_id, experience_id, recheck_days, **kwargs):
+    lastDay = store.lastDay(account_id, project_id, experience_id)
+    since = None
+    if lastDay is not None:
+        since = (date.fromisoformat(lastDay) - timedelta(days=recheck_days)).isoformat()
+        kwargs['bodyParams'] = dict(kwargs.get('bodyParams') or {},
+                                    start_time=timegm(time.strptime(since, "%Y-%m-%d")),
+                                    end_time=int(time.time()))
+
+    rows = []
+    for record in streamExperienceDailyReport(account_id, project_id, experience_id, **kwargs):
+        day = _dayOf(record)
+        if day is None:
+            log.warning("Skipping daily report row without a '{}' of experience {}: {}".format(
+                DAY_FIELD, experience_id, record))
+        elif since is None or day >= since:
+            rows.append((record.get("variation_id"), day, record))
+
+    # merge only once the whole response is in, so a failed download leaves
+    # the store untouched and the write lock isn't held while downloading
+    return store.merge(account_id, project_id, experience_id, rows)
+
+
+def syncDailyReports(account_id, project_id, experience_ids, store, recheck_days=2,
+                     max_workers=4, **kwargs):
+    """Brings the daily report rows of the given experiences in `store` (a
+    DailyReportStore or a path to one) up to date.
+
+    The first sync of an experience fetches its whole history; later ones
+    only fetch from `recheck_days` before the last synced day on. Up to
+    max_workers experiences are synced concurrently over one HTTP session
+    (the 'session' kwarg, or a new one). Returns a dict of experience ID
+    to the number of rows written, or False where the sync failed (its
+    stored rows are then left as they were).
+    """
+    from .client import createSession
+
+    if not isinstance(store, DailyReportStore):
+        store = DailyReportStore(store)
+
+    session = kwargs.pop('session', None)
+    ownsSession = session is None
+    if ownsSession:
+        session = createSession(pool_maxsize=max_workers)
+
+    def sync(experience_id):
+        try:
+            return _syncExperience(store, account_id, project_id, experience_id, recheck_days,
+                                   session=session, **kwargs)
+        except Exception as e:
+            log.error("Failed to sync the daily report of experience {expId} in account/project {accountId}/{projectId}: {e}".format(
+                expId=experience_id, accountId=account_id, projectId=project_id, e=e))
+            return False
+
+    experience_ids = list(experience_ids)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            return dict(zip(experience_ids, pool.map(sync, experience_ids)))
+    finally:
+        if ownsSession:
+            session.close()
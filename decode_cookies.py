@@ -0,0 +1,47 @@
+#!/usr/bin/python
+
+import logging
+import argparse
+import sys
+
+from convertcom import decodeCookies
+
+logging.basicConfig(
+    format='%(asctime)s.%(msecs)03d %(levelname)s %(module)s::%(funcName)s(): %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+)
+log = logging.getLogger()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Decode newline-delimited _conv_v cookie values to NDJSON, in input order")
+
+    # Positional args
+    parser.add_argument('input', type=str, nargs='?', default='-', help="file of cookie values, one per line (default: stdin)")
+    parser.add_argument('-o', '--output', type=str, default='-', help="output file (default: stdout)")
+    parser.add_argument('-w', '--workers', type=int, default=None, help="number of worker processes (default: one per CPU)")
+    parser.add_argument('-c', '--chunksize', type=int, default=1000, help="cookies per chunk sent to a worker")
+    parser.add_argument('-v', '--verbose', action='count', default=0)
+    parser.add_argument('-q', '--quiet', action='store_true')
+    args = parser.parse_args()
+
+    if args.quiet:
+        log.setLevel("ERROR")
+    elif args.verbose > 0:
+        log.setLevel("DEBUG")
+    else:
+        log.setLevel("INFO")
+
+    inFile = sys.stdin if args.input == '-' else open(args.input)
+    outFile = sys.stdout if args.output == '-' else open(args.output, 'w')
+
+    cookies = (line.strip() for line in inFile)
+    count = 0
+    for line in decodeCookies(cookies, workers=args.workers, chunksize=args.chunksize, ndjson=True):
+        outFile.write(line)
+        outFile.write("\n")
+        count += 1
+
+    outFile.flush()
+    log.debug("Decoded {} cookies".format(count))
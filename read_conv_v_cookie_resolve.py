@@ -74,28 +74,7 @@ if __name__ == "__main__":
             ))
             exit(1)
 
-        r = {}
-        for i in j["Experiments"]:
-            d = j["Experiments"][i]
-            if i in e:
-                k = "{} ({})".format(e[i], i)
-                r[k] = {
-                    "g": d["g"],
-                    "v": {}
-                } # copy goals
-                # now do variants
-                dv = str(d["v"])
-                if dv in v[i]:
-                    r[k]["v"] = v[i][dv]
-                elif dv == "1":
-                    r[k]["v"] = "*Excluded*"
-                else:
-                    log.warning("Could not find variant id '{}' in variant map for experience '{}'!".format(
-                        dv, i))
-            else:
-                log.warning("Could not find experience id '{}' in experience map!".format(i))
-        if r:
-            j["Experiments"] = r
+        j = convertcom.resolveCookieData(j, e, v)
 
 
         print(json.dumps(j, indent=2))